@@ -1,10 +1,15 @@
 import glob
 import os
+import sys
 import numpy as np
 import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', '..', 'analysis', '01_unzip'))
+from babs_zip import PIPELINES, iter_zip_members, list_archives  # noqa: E402
+
 # ----------------------
 # Paths
 # ----------------------
@@ -12,6 +17,9 @@ project_path = '/cbica/projects/executive_function/'
 inpath_qc = os.path.join(project_path, 'EF_dataset/derivatives/aslprep_BABS_EF_full_project_outputs/aslprep/') #CUBIC project path - replace
 outpath = os.path.join(project_path, 'EF_dataset_figures/concatenated_data/') #CUBIC project path - replace
 os.makedirs(outpath, exist_ok=True)
+# set to True to read the qc files straight from the aslprep BABS zips
+# instead of the unzipped copies in inpath_qc
+from_zips = False
 
 # ----------------------
 # Get all QC file paths
@@ -25,10 +33,19 @@ fileNames_qc = sorted(
 # ----------------------
 # Loop through files, compute mean QC values
 # ----------------------
+if from_zips:
+    zip_list = list_archives(PIPELINES['aslprep_2'],
+                             os.path.join(project_path, 'EF_dataset'))
+    # members come sorted by name, in the same order as fileNames_qc
+    qc_files = ((name, f) for _, name, f in iter_zip_members(
+        zip_list, 'sub-*_ses-*_run-*_desc-qualitycontrol_cbf.tsv'))
+else:
+    qc_files = ((fpath, fpath) for fpath in fileNames_qc)
+
 rows = []
 
-for fpath in fileNames_qc:
-    subj_qc = pd.read_csv(fpath, delimiter='\t')
+for fpath, f in qc_files:
+    subj_qc = pd.read_csv(f, delimiter='\t')
 
     # Drop any unnamed index columns
     subj_qc = subj_qc.loc[:, ~subj_qc.columns.str.startswith('Unnamed')]
@@ -3,24 +3,41 @@ import glob
 import pandas as pd
 import numpy as np
 import os
+import sys
 import seaborn as sns
 import matplotlib.pyplot as plt
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', '..', 'analysis', '01_unzip'))
+from babs_zip import PIPELINES, iter_zip_members, list_archives  # noqa: E402
+
 
 project_path = '/cbica/projects/executive_function/'
 inpath_qc = project_path + 'EF_dataset/derivatives/qsiprep_BABS_EF_full_project_outputs/qsiprep' #CUBIC project path - replace
 outpath = project_path + 'EF_dataset_figures/concatenated_data/' #CUBIC project path - replace
+# set to True to read the qc files straight from the qsiprep BABS zips
+# instead of the unzipped copies in inpath_qc
+from_zips = False
 
 fileNames_qc = sorted(glob.glob(os.path.join(
     inpath_qc, 'sub-*', 'ses-*', 'dwi',
     'sub-*_ses-*_space-*_desc-image_qc.tsv'
 )))
 
+if from_zips:
+    zip_list = list_archives(PIPELINES['qsiprep'],
+                             os.path.join(project_path, 'EF_dataset'))
+    # members come sorted by name, in the same order as fileNames_qc
+    qc_files = ((name, f) for _, name, f in iter_zip_members(
+        zip_list, 'sub-*_ses-*_space-*_desc-image_qc.tsv'))
+else:
+    qc_files = ((fpath, fpath) for fpath in fileNames_qc)
+
 df_all = []
 
-for fpath in fileNames_qc:
+for fpath, f in qc_files:
     # Load single-row coverage data
-    df_qc = pd.read_csv(fpath, delimiter='\t')
+    df_qc = pd.read_csv(f, delimiter='\t')
 
     # Extract metadata from filename
     fname_parts = os.path.basename(fpath).split('_')
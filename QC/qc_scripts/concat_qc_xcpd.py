@@ -1,9 +1,16 @@
+import os
+import sys
 import glob
 import numpy as np
 import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             '..', '..', 'analysis', '01_unzip'))
+from babs_zip import (PIPELINES, list_archives, list_zip_members,  # noqa: E402
+                      open_zip_members)
+
 project_path = '/cbica/projects/executive_function/'
 
 ################
@@ -13,11 +20,31 @@ project_path = '/cbica/projects/executive_function/'
 inpath_qc = project_path + 'EF_dataset/derivatives/xcpd_BABS_EF_full_project_outputs/xcpd/' #CUBIC project path - replace
 # outpath to save concatentaed qc data
 outpath = project_path + 'EF_dataset_figures/concatenated_data/' #CUBIC project path - replace
+# set to True to read the qc files straight from the xcpd BABS zips
+# instead of the unzipped copies in inpath_qc
+from_zips = False
 
 # get all filenames for qc data
-fileNames_qc = sorted(glob.glob(inpath_qc + 'sub-*/ses-*/func/' +
-                                'sub-*_ses-*_task-*_run-*' +
-                                '_motion.tsv'))
+if from_zips:
+    zip_list = list_archives(PIPELINES['xcpd'], project_path + 'EF_dataset/')
+    zip_members = list_zip_members(zip_list,
+                                   'sub-*_ses-*_task-*_run-*_motion.tsv')
+    fileNames_qc = [name for _, name in zip_members]
+else:
+    fileNames_qc = sorted(glob.glob(inpath_qc + 'sub-*/ses-*/func/' +
+                                    'sub-*_ses-*_task-*_run-*' +
+                                    '_motion.tsv'))
+
+
+def read_qc_tables(indices):
+    # load the qc files fileNames_qc[i] one at a time, from the zips or the
+    # unzipped copies
+    if from_zips:
+        members = [zip_members[i] for i in indices]
+        return (pd.read_csv(f, delimiter='\t')
+                for _, _, f in open_zip_members(members))
+    return (pd.read_csv(fileNames_qc[i], delimiter='\t') for i in indices)
+
 
 # get subject IDs based on filenames
 subjList_qc = [fileNames_qc[s].split('/')[-1].split('_')[0]
@@ -35,14 +62,13 @@ maxidx = np.where(np.array(check_filename) == unique_namelength.max())[0][0]
 split_name = fileNames_qc[maxidx].split('/')[-1].split('_')
 col_names_max = [split_title.split('-')[0] for split_title in split_name[:-1]]
 # then get column names from the actual qc file
-subj_qc = pd.read_csv(fileNames_qc[maxidx], delimiter='\t')
+subj_qc = next(read_qc_tables([maxidx]))
 # finally generate main df for qc
 df_main_qc = pd.DataFrame(columns=list(col_names_max) + list(subj_qc.columns))
 
 # fill in the main qc df
-for iSubj in range(len(subjList_qc)):
-    # load each subject file
-    subj_qc = pd.read_csv(fileNames_qc[iSubj], delimiter='\t')
+for iSubj, subj_qc in enumerate(read_qc_tables(range(len(subjList_qc)))):
+    # each subject file is loaded as the loop gets to it
     # Calculate the median across rows (each subj file has multiple rows)
     median_series = subj_qc.median(axis=0)
     # Convert the median Series to a dataframe with one row + reset index
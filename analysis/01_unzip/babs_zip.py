@@ -0,0 +1,317 @@
+import os
+import re
+import glob
+import fnmatch
+import zipfile
+import zlib
+from collections import namedtuple
+
+# Shared helpers for pulling derivative files out of the BABS output zips
+# (sub-*_ses-*_<pipeline>.zip). Used by unzip_derivatives.py, and by the QC
+# concat scripts to read files straight from the zips without unzipping.
+
+# CUBIC project path
+datapath = '/cbica/projects/executive_function/EF_dataset/'
+
+
+# One spec per set of files we pull out of a pipeline's zips.
+#   zip_dir  : folder holding the BABS zips, relative to datapath
+#   zip_glob : glob for the zips inside zip_dir
+#   suffixes : file name endings of the members we want
+#   dest     : folder to extract into, relative to datapath
+PipelineSpec = namedtuple('PipelineSpec',
+                          ['name', 'zip_dir', 'zip_glob', 'suffixes', 'dest'])
+
+_xcpd = 'derivatives/xcpd_BABS_EF_full_project_outputs/'
+_xcpd_zip = 'sub-*_ses-*_xcpd-0-10-7.zip'
+_qsiprep = 'derivatives/qsiprep_BABS_EF_full_project_outputs/'
+_qsiprep_zip = 'sub-*_ses-*_qsiprep-1-0-0.zip'
+_qsirecon = 'derivatives/qsirecon_BABS_EF_full_project_outputs/'
+_qsirecon_zip = 'sub-*_ses-*_qsirecon-1-1-0.zip'
+_aslprep = 'derivatives/aslprep_BABS_EF_full_project_outputs/'
+_aslprep_zip = 'sub-*_ses-*_aslprep-0-7-5.zip'
+_anat = 'derivatives/fmriprepANAT_BABS_EF_full_project_outputs/'
+_anat_zip = 'sub-*_ses-*_fmriprep_anat-25-0-0.zip'
+_fspost = 'derivatives/freesurfer-post_BABS_EF_full_project_outputs/'
+_fspost_zip = 'sub-*_ses-*_freesurfer-post-0-1-2.zip'
+
+# names follow the unzip_<name>_files.py scripts these specs replaced
+PIPELINES = {spec.name: spec for spec in [
+    PipelineSpec('xcpd', _xcpd, _xcpd_zip,
+                 ['_space-fsLR_seg-4S456Parcels_den-91k'
+                  '_stat-pearsoncorrelation_boldmap.pconn.nii',
+                  '_space-fsLR_seg-4S456Parcels_stat-alff_bold.tsv',
+                  '_space-fsLR_seg-4S456Parcels_stat-reho_bold.tsv',
+                  '_motion.tsv'],
+                 ''),
+    PipelineSpec('xcpd_2', _xcpd, _xcpd_zip,
+                 ['_seg-4S156Parcels_stat-pearsoncorrelation_relmat.tsv'],
+                 _xcpd),
+    PipelineSpec('xcpd_3', _xcpd, _xcpd_zip,
+                 ['_seg-4S1056Parcels_stat-coverage_bold.tsv',
+                  '_seg-4S156Parcels_stat-coverage_bold.tsv'],
+                 _xcpd),
+    PipelineSpec('xcpd_4', _xcpd, _xcpd_zip,
+                 ['_seg-4S1056Parcels_stat-pearsoncorrelation_relmat.tsv'],
+                 _xcpd),
+    # pconn.nii of every atlas, for plot_corrmat.py --pconn
+    PipelineSpec('xcpd_pconn', _xcpd, _xcpd_zip,
+                 ['_den-91k_stat-pearsoncorrelation_boldmap.pconn.nii'],
+                 _xcpd),
+    PipelineSpec('qsiprep', _qsiprep, _qsiprep_zip,
+                 ['_desc-image_qc.tsv'],
+                 _qsiprep),
+    PipelineSpec('qsiprep_2', _qsiprep, _qsiprep_zip,
+                 ['_space-ACPC_desc-preproc_T1w.nii.gz'],
+                 _qsiprep),
+    PipelineSpec('qsirecon', _qsirecon, _qsirecon_zip,
+                 ['_space-MNI152NLin2009cAsym_model-tensor_param-fa'
+                  '_dwimap.nii.gz',
+                  '_space-MNI152NLin2009cAsym_model-tensor_param-md'
+                  '_dwimap.nii.gz',
+                  '_space-MNI152NLin2009cAsym_model-gqi_param-gfa'
+                  '_dwimap.nii.gz'],
+                 ''),
+    PipelineSpec('qsirecon_2', _qsirecon, _qsirecon_zip,
+                 ['_bundlestats.csv'],
+                 _qsirecon),
+    PipelineSpec('aslprep', _aslprep, _aslprep_zip,
+                 ['_space-MNI152NLin6Asym_cbf.nii.gz',
+                  '_space-MNI152NLin6Asym_desc-basil_att.nii.gz',
+                  '_space-MNI152NLin6Asym_desc-basil_cbf.nii.gz',
+                  '_space-MNI152NLin6Asym_desc-basilGM_cbf.nii.gz',
+                  '_space-MNI152NLin6Asym_desc-basilWM_cbf.nii.gz'],
+                 ''),
+    PipelineSpec('aslprep_2', _aslprep, _aslprep_zip,
+                 ['_desc-qualitycontrol_cbf.tsv'],
+                 _aslprep),
+    PipelineSpec('fmriprepANAT', _anat, _anat_zip,
+                 ['_space-fsLR_den-91k_thickness.dscalar.nii',
+                  '_space-fsLR_den-91k_curv.dscalar.nii',
+                  '_space-fsLR_den-91k_sulc.dscalar.nii'],
+                 ''),
+    PipelineSpec('fmriprepANAT_2', _anat, _anat_zip,
+                 ['_space-MNI152NLin6Asym_res-1_desc-preproc_T1w.nii.gz',
+                  '_desc-preproc_T1w.nii.gz'],
+                 _anat),
+    PipelineSpec('fmriprepANAT_3', _anat, _anat_zip,
+                 ['_from-T1w_to-MNI152NLin6Asym_mode-image_xfm.h5'],
+                 _anat),
+    PipelineSpec('freesurfer-post', _fspost, _fspost_zip,
+                 ['_desc-FreeSurfer_qc.tsv'],
+                 _fspost),
+    # grab the files needed to make the slices for manual T1 ratings
+    PipelineSpec('QC_T1_MNI', _anat, _anat_zip,
+                 ['_space-MNI152NLin6Asym_res-1_desc-preproc_T1w.nii.gz'],
+                 os.path.join(_anat, 'QC/T1w_space-MNI/')),
+    PipelineSpec('QC_T1_native', _anat, _anat_zip,
+                 ['_desc-preproc_T1w.nii.gz'],
+                 os.path.join(_anat, 'QC/T1w_space-native/')),
+]}
+
+
+def list_archives(spec, root=datapath):
+    return sorted(glob.glob(os.path.join(root, spec.zip_dir, spec.zip_glob)))
+
+
+class MemberMatcher:
+    """Select archive members whose names end with any of the suffixes.
+
+    All suffixes are escaped and compiled into a single alternation anchored
+    at the end of the name, so each member is checked with one regex call.
+    """
+
+    def __init__(self, suffixes):
+        self.suffixes = tuple(suffixes)
+        self.pattern = re.compile(
+            '(?:%s)\\Z' % '|'.join(re.escape(s) for s in self.suffixes))
+
+    def match(self, name):
+        return self.pattern.search(name) is not None
+
+    def select(self, names):
+        search = self.pattern.search
+        return [name for name in names if search(name)]
+
+
+MemberRecord = namedtuple('MemberRecord', ['name', 'file_size', 'crc'])
+
+
+def archive_key(zip_path):
+    # identity of an archive on disk, used to tell when cached info is stale
+    st = os.stat(zip_path)
+    return st.st_size, st.st_mtime_ns
+
+
+def member_records(infos):
+    return [MemberRecord(info.filename, info.file_size, info.CRC)
+            for info in infos]
+
+
+# One extracted file: the member it came from, where it was written, and the
+# member's size and CRC at the time. mtime_ns is the extracted file's mtime,
+# so later edits or truncation of the copy on disk are noticed.
+ManifestEntry = namedtuple('ManifestEntry',
+                           ['member', 'path', 'file_size', 'crc', 'mtime_ns'])
+
+
+def is_current(entry, record):
+    # an earlier extraction of this member is still intact on disk
+    if entry is None or (entry.file_size, entry.crc) != (record.file_size,
+                                                         record.crc):
+        return False
+    try:
+        st = os.stat(entry.path)
+    except FileNotFoundError:
+        return False
+    return st.st_size == entry.file_size and st.st_mtime_ns == entry.mtime_ns
+
+
+# A member that could not be extracted intact. expected_* come from the
+# archive's central directory, size and crc from the bytes written before the
+# failure. An empty member means the archive itself could not be read.
+ExtractFailure = namedtuple('ExtractFailure',
+                            ['zip_path', 'member', 'expected_size',
+                             'expected_crc', 'size', 'crc', 'error'])
+
+# errors that mean a bad archive or member rather than a bug
+read_errors = (zipfile.BadZipFile, zlib.error, EOFError, OSError)
+
+
+class ExtractError(Exception):
+    def __init__(self, message, size, crc):
+        super().__init__(message)
+        self.size = size
+        self.crc = crc
+
+
+def extract_verified(zf, info, dest, chunk_size=1 << 20):
+    """Extract one member, checking size and CRC of the bytes written.
+
+    The member is streamed to a temporary file next to its destination and
+    checksummed in the same pass; it is only moved into place if it matches
+    the central directory, so a bad or partial copy never replaces a file.
+    Read and write errors (e.g. a full disk) are raised as ExtractError.
+    Returns the path written and the (size, crc) seen.
+    """
+    path = os.path.join(dest, *info.filename.split('/'))
+    root = os.path.abspath(dest)
+    if os.path.commonpath([root, os.path.abspath(path)]) != root:
+        raise ExtractError('member outside of destination', 0, 0)
+    tmp = path + '.part'
+    size = 0
+    crc = 0
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with zf.open(info) as src, open(tmp, 'wb') as out:
+            for chunk in iter(lambda: src.read(chunk_size), b''):
+                out.write(chunk)
+                size += len(chunk)
+                crc = zlib.crc32(chunk, crc)
+        if (size, crc) != (info.file_size, info.CRC):
+            raise ExtractError('size/CRC mismatch', size, crc)
+        os.replace(tmp, path)
+    except BaseException as err:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        if isinstance(err, read_errors):
+            raise ExtractError(repr(err), size, crc) from err
+        raise
+    return path, size, crc
+
+
+# scanned: number of members in the archive's central directory
+# matched: number of members selected for extraction (after any QC filter)
+# skipped: matched members already extracted and unchanged since
+# key, members: archive identity and central directory, for the zip index
+# extracted: ManifestEntry for each member written intact in this run
+# failed: ExtractFailure for each member that was not
+ArchiveStats = namedtuple('ArchiveStats',
+                          ['zip_path', 'scanned', 'matched', 'skipped',
+                           'key', 'members', 'extracted', 'failed'])
+
+
+def extract_archive(zip_path, suffixes, dest, done=None, keep=None):
+    # done maps member names to the ManifestEntry of an earlier extraction;
+    # keep, if given, is called with each matching member name and returns
+    # False for members to leave out (e.g. a qc_filter.QCFilter)
+    done = done or {}
+    matcher = MemberMatcher(suffixes)
+    matched = 0
+    extracted = []
+    failed = []
+    # open each archive once: list, select and extract from the same handle
+    try:
+        key = archive_key(zip_path)
+        zf = zipfile.ZipFile(zip_path)
+    except read_errors as err:
+        failed.append(ExtractFailure(zip_path, '', None, None, None, None,
+                                     repr(err)))
+        return ArchiveStats(zip_path, 0, 0, 0, None, None, [], failed)
+    with zf:
+        infos = zf.infolist()
+        records = member_records(infos)
+        for info, record in zip(infos, records):
+            if not matcher.match(record.name):
+                continue
+            if keep is not None and not keep(record.name):
+                continue
+            matched += 1
+            if is_current(done.get(record.name), record):
+                continue
+            try:
+                path, size, crc = extract_verified(zf, info, dest)
+            except ExtractError as err:
+                failed.append(ExtractFailure(zip_path, record.name,
+                                             record.file_size, record.crc,
+                                             err.size, err.crc, str(err)))
+                continue
+            extracted.append(ManifestEntry(record.name, path, size, crc,
+                                           os.stat(path).st_mtime_ns))
+    return ArchiveStats(zip_path, len(infos), matched,
+                        matched - len(extracted) - len(failed), key, records,
+                        extracted, failed)
+
+
+def list_zip_members(zip_paths, pattern):
+    """(zip_path, member name) of the members matching pattern, sorted by
+    member name, so they come in the order a sorted glob of the unzipped
+    files would.
+
+    pattern is a glob on the member's file name (e.g. 'sub-*_motion.tsv').
+    """
+    match = re.compile(fnmatch.translate(pattern)).match
+    members = []
+    for zip_path in zip_paths:
+        with zipfile.ZipFile(zip_path) as zf:
+            members += [(zip_path, info.filename) for info in zf.infolist()
+                        if match(os.path.basename(info.filename))]
+    return sorted(members, key=lambda member: member[1])
+
+
+def open_zip_members(members):
+    """Yield (zip_path, member name, open file) for (zip_path, member name)
+    pairs, in order.
+
+    Each file is a read-only stream over the compressed member, so it can be
+    passed straight to pandas; nothing is written to disk. Only the archive
+    of the current member is kept open.
+    """
+    zip_path, zf = None, None
+    try:
+        for member_zip, name in members:
+            if member_zip != zip_path:
+                if zf is not None:
+                    zf.close()
+                zip_path, zf = member_zip, zipfile.ZipFile(member_zip)
+            with zf.open(name) as f:
+                yield zip_path, name, f
+    finally:
+        if zf is not None:
+            zf.close()
+
+
+def iter_zip_members(zip_paths, pattern):
+    """Yield (zip_path, member name, open file) for members matching
+    pattern, sorted by member name (see list_zip_members)."""
+    return open_zip_members(list_zip_members(zip_paths, pattern))
@@ -0,0 +1,61 @@
+import os
+import sqlite3
+
+from babs_zip import ManifestEntry
+
+# Record of what unzip_derivatives.py has extracted: for each destination
+# folder and archive, the members written, where they went, and the member
+# size and CRC. Entries are committed as soon as an archive finishes, so an
+# interrupted run picks up from the archives that were still in progress.
+
+default_manifest = os.path.join(os.path.expanduser('~'), '.cache',
+                                'babs_extraction_manifest.sqlite')
+
+_schema = '''
+CREATE TABLE IF NOT EXISTS extracted (
+    dest TEXT NOT NULL,
+    archive TEXT NOT NULL,
+    member TEXT NOT NULL,
+    path TEXT NOT NULL,
+    file_size INTEGER NOT NULL,
+    crc INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    PRIMARY KEY (dest, archive, member)
+);
+'''
+
+
+class ExtractionManifest:
+    """SQLite record of members extracted from each archive."""
+
+    def __init__(self, db_path=default_manifest):
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.executescript(_schema)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def entries(self, dest, zip_path):
+        """ManifestEntry of every member extracted from zip_path to dest."""
+        rows = self.conn.execute(
+            'SELECT member, path, file_size, crc, mtime_ns FROM extracted '
+            'WHERE dest = ? AND archive = ?',
+            (os.path.abspath(dest), os.path.abspath(zip_path)))
+        return {row[0]: ManifestEntry(*row) for row in rows}
+
+    def record(self, dest, zip_path, entries):
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO extracted VALUES '
+                '(?, ?, ?, ?, ?, ?, ?)',
+                [(os.path.abspath(dest), os.path.abspath(zip_path))
+                 + tuple(entry) for entry in entries])
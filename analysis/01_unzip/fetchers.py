@@ -0,0 +1,52 @@
+import os
+import shutil
+
+# Fetchers make an archive available on disk before it is extracted and
+# release it afterwards. unzip_derivatives.py only needs get(path) and
+# drop(path), so anything with those two methods can be plugged in.
+
+
+class PresentFetcher:
+    """Archives are already on disk (e.g. after a manual 'datalad get')."""
+
+    def get(self, path):
+        pass
+
+    def drop(self, path):
+        pass
+
+
+class DataladFetcher:
+    """'datalad get' each archive before extraction, 'datalad drop' after."""
+
+    def __init__(self, dataset_path):
+        import datalad.api as dl
+
+        self.ds = dl.Dataset(dataset_path)
+
+    def get(self, path):
+        self.ds.get(path)
+
+    def drop(self, path):
+        self.ds.drop(path)
+
+
+class CopyFetcher:
+    """Copy archives in from a local store, and leave a dangling link after.
+
+    A stand-in for a DataLad remote: like an annexed file that has been
+    dropped, a released archive is still listed but has no content.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    def get(self, path):
+        if os.path.lexists(path):
+            os.remove(path)
+        shutil.copy2(os.path.join(self.store, os.path.basename(path)), path)
+
+    def drop(self, path):
+        os.remove(path)
+        dropped = os.path.join(self.store, '.dropped', os.path.basename(path))
+        os.symlink(dropped, path)
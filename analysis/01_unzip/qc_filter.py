@@ -0,0 +1,89 @@
+import os
+import re
+import csv
+
+# Decide which scans to extract from their QC status, so unzip_derivatives.py
+# can skip files for scans that failed QC.
+#
+# QC status comes from /QC/qc_csvs/qc_summary.csv (one row per session, one
+# column per modality) and/or one of the /QC/excluded_scans_*.csv lists.
+# qc_summary.csv only records flagged scans, so blank cells and sessions that
+# are not listed count as 'pass'.
+
+qc_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      '..', '..', 'QC')
+qc_summary_file = os.path.join(qc_dir, 'qc_csvs', 'qc_summary.csv')
+
+# qc_summary.csv column(s) for each modality; fMRI columns are per task/run
+MODALITY_COLUMNS = {
+    'T1': 'T1 QC',
+    'diffusion': 'Diffusion QC',
+    'bundles': 'Diffusion individual bundles QC',
+    'asl': 'ASL QC',
+    'fmri': {('rest', '01'): 'fMRI rest run 01',
+             ('rest', '02'): 'fMRI rest run 02',
+             ('rest', '03'): 'fMRI rest run 03 (variant)',
+             ('nback', '01'): 'fMRI nback',
+             ('nback', '02'): 'fMRI nback run 02 (variant)'},
+}
+
+_entity = re.compile(r'(?:^|_)(sub|ses|task|run)-([^_/]+)')
+
+
+def parse_entities(name):
+    return dict(_entity.findall(os.path.basename(name)))
+
+
+def read_qc_summary(path=qc_summary_file):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        return {(row['subject'], row['session']): row
+                for row in csv.DictReader(f)}
+
+
+def read_excluded_scans(path):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        return {row['excluded_scans'].strip() for row in csv.DictReader(f)
+                if row['excluded_scans'].strip()}
+
+
+class QCFilter:
+    """Keep members whose scan has one of the wanted QC statuses.
+
+    modality picks the qc_summary.csv column(s) to read (see
+    MODALITY_COLUMNS), statuses the values to keep (e.g. ('pass',)).
+    Members whose file name starts with a scan ID from excluded_scans are
+    dropped as well. Instances are picklable, so they can be handed to the
+    extraction workers.
+    """
+
+    def __init__(self, modality=None, statuses=('pass',), summary=None,
+                 excluded_scans=()):
+        if modality is not None and modality not in MODALITY_COLUMNS:
+            raise ValueError('unknown QC modality %r, expected one of %s'
+                             % (modality, ', '.join(MODALITY_COLUMNS)))
+        self.modality = modality
+        self.statuses = set(statuses)
+        if summary is None and modality is not None:
+            summary = read_qc_summary()
+        self.summary = summary or {}
+        self.excluded_scans = set(excluded_scans)
+        self._excluded_prefixes = tuple(scan + '_'
+                                        for scan in sorted(excluded_scans))
+
+    def status(self, name):
+        entities = parse_entities(name)
+        row = self.summary.get(('sub-%s' % entities.get('sub'),
+                                'ses-%s' % entities.get('ses')))
+        column = MODALITY_COLUMNS[self.modality]
+        if isinstance(column, dict):
+            column = column.get((entities.get('task'), entities.get('run')))
+        if row is None or column is None:
+            return 'pass'
+        return row[column].strip() or 'pass'
+
+    def __call__(self, name):
+        if os.path.basename(name).startswith(self._excluded_prefixes):
+            return False
+        if self.modality is None:
+            return True
+        return self.status(name) in self.statuses
@@ -0,0 +1,49 @@
+import os
+import zipfile
+
+from babs_zip import PIPELINES, MemberMatcher, extract_archive
+
+# Run with: python -m pytest analysis/01_unzip
+
+
+def test_matcher_is_anchored_at_the_end():
+    matcher = MemberMatcher(['_qc.tsv', '_desc-preproc_T1w.nii.gz'])
+    assert matcher.match('qsiprep/sub-01/sub-01_desc-image_qc.tsv')
+    assert matcher.match('sub-01_ses-1_desc-preproc_T1w.nii.gz')
+    assert not matcher.match('sub-01_desc-image_qc.tsv.bak')
+    assert not matcher.match('sub-01_qc.tsv/sub-01_report.html')
+    assert not matcher.match('sub-01_desc-preproc_T1w.nii')
+
+
+def test_matcher_escapes_suffixes():
+    matcher = MemberMatcher(['.pconn.nii', '_desc-(basil)+_cbf.nii.gz'])
+    assert matcher.match('sub-01_boldmap.pconn.nii')
+    assert not matcher.match('sub-01_boldmapXpconnXnii')
+    assert matcher.match('sub-01_desc-(basil)+_cbf.nii.gz')
+    assert not matcher.match('sub-01_desc-basilbasil_cbf.nii.gz')
+
+
+def test_select_agrees_with_endswith():
+    suffixes = [s for spec in PIPELINES.values() for s in spec.suffixes]
+    names = ['sub-01/ses-1/sub-01_ses-1' + suffix + tail
+             for suffix in suffixes for tail in ['', '.json', '.gz', 'x']]
+    matcher = MemberMatcher(suffixes)
+    assert matcher.select(names) == [name for name in names
+                                     if name.endswith(tuple(suffixes))]
+
+
+def test_write_errors_are_extract_errors(tmp_path):
+    zip_path = str(tmp_path / 'sub-01_ses-1_test.zip')
+    with zipfile.ZipFile(zip_path, 'w') as zf:
+        zf.writestr('test/sub-01_qc.tsv', 'a\tb\n1\t2\n')
+        zf.writestr('sub-01_qc.tsv', 'a\tb\n1\t2\n')
+    dest = tmp_path / 'extracted'
+    os.makedirs(dest / 'sub-01_qc.tsv')
+    # a file where a folder should go, and a folder where a file should go
+    (dest / 'test').write_text('')
+    stats = extract_archive(zip_path, ['_qc.tsv'], str(dest))
+
+    assert [f.member for f in stats.failed] == ['test/sub-01_qc.tsv',
+                                                'sub-01_qc.tsv']
+    assert not stats.extracted
+    assert sorted(os.listdir(dest)) == ['sub-01_qc.tsv', 'test']
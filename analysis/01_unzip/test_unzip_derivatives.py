@@ -0,0 +1,205 @@
+import os
+import csv
+import struct
+import zipfile
+
+from babs_zip import PipelineSpec
+from extraction_manifest import ExtractionManifest
+from fetchers import CopyFetcher
+from qc_filter import QCFilter, read_excluded_scans, read_qc_summary
+from unzip_derivatives import run_pipeline, write_failure_report
+from zip_index import ZipIndex
+
+# Run with: python -m pytest analysis/01_unzip
+
+N_ZIPS = 10
+SPEC = PipelineSpec('test', 'derivatives', 'sub-*_ses-*_test.zip',
+                    ['_qc.tsv'], 'extracted')
+
+
+def zip_name(i):
+    return 'sub-%02d_ses-1_test.zip' % i
+
+
+def qc_name(i):
+    return 'sub-%02d_ses-1_qc.tsv' % i
+
+
+def make_zip(path, i):
+    with zipfile.ZipFile(path, 'w') as zf:
+        zf.writestr('test/sub-%02d/ses-1/%s' % (i, qc_name(i)),
+                    'a\tb\n%d\t%d\n' % (i, i))
+        zf.writestr('test/sub-%02d/ses-1/sub-%02d_ses-1_other.txt'
+                    % (i, i), 'x' * 1000)
+
+
+def make_zips(tmp_path):
+    zip_dir = tmp_path / 'ds' / 'derivatives'
+    os.makedirs(zip_dir)
+    for i in range(N_ZIPS):
+        make_zip(zip_dir / zip_name(i), i)
+    return zip_dir
+
+
+def extracted(tmp_path):
+    dest = tmp_path / 'ds' / 'extracted'
+    return sorted(name for _, _, names in os.walk(dest) for name in names)
+
+
+def test_touched_archive_is_reindexed(tmp_path):
+    zip_dir = make_zips(tmp_path)
+    touched = str(zip_dir / zip_name(4))
+    with ZipIndex(str(tmp_path / 'index.sqlite')) as index:
+        run_pipeline(SPEC, tmp_path / 'ds', index=index)
+        assert len(index.lookup(touched)) == 2
+
+        st = os.stat(touched)
+        os.utime(touched, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+        assert index.lookup(touched) is None
+        with zipfile.ZipFile(touched, 'a') as zf:
+            zf.writestr('test/sub-04/ses-1/sub-04_ses-1_run-2_qc.tsv', '')
+        run_pipeline(SPEC, tmp_path / 'ds', index=index)
+
+        assert [r.name for r in index.lookup(touched)][-1] == (
+            'test/sub-04/ses-1/sub-04_ses-1_run-2_qc.tsv')
+        assert len(index.lookup(str(zip_dir / zip_name(5)))) == 2
+    assert 'sub-04_ses-1_run-2_qc.tsv' in extracted(tmp_path)
+
+
+def test_interrupted_run_resumes(tmp_path):
+    make_zips(tmp_path)
+    with ExtractionManifest(str(tmp_path / 'manifest.sqlite')) as manifest:
+        # a run that stopped after the first half of the archives
+        first_half = SPEC._replace(zip_glob='sub-0[0-4]_ses-*_test.zip')
+        run_pipeline(first_half, tmp_path / 'ds', manifest=manifest)
+        # and an extracted file that has been deleted since
+        os.remove(tmp_path / 'ds' / 'extracted' / 'test' / 'sub-02'
+                  / 'ses-1' / qc_name(2))
+        all_stats = run_pipeline(SPEC, tmp_path / 'ds', manifest=manifest)
+
+    written = sorted(os.path.basename(entry.path) for stats in all_stats
+                     for entry in stats.extracted)
+    assert written == [qc_name(i) for i in [2] + list(range(5, N_ZIPS))]
+    assert sum(stats.skipped for stats in all_stats) == 4
+    assert extracted(tmp_path) == [qc_name(i) for i in range(N_ZIPS)]
+
+
+class CountingFetcher(CopyFetcher):
+    """CopyFetcher that records the most archives on disk at once."""
+
+    def __init__(self, store, zip_dir, missing=()):
+        super().__init__(store)
+        self.zip_dir = zip_dir
+        self.missing = set(missing)
+        self.most_on_disk = 0
+
+    def on_disk(self):
+        # dropped archives are left as dangling links
+        return sum(not os.path.islink(os.path.join(self.zip_dir, name))
+                   for name in os.listdir(self.zip_dir))
+
+    def get(self, path):
+        if os.path.basename(path) in self.missing:
+            raise OSError('no such archive in the store: %s' % path)
+        super().get(path)
+        self.most_on_disk = max(self.most_on_disk, self.on_disk())
+
+
+def make_dataset(tmp_path):
+    # Archives in a local store, each listed in the dataset as a dropped
+    # (dangling) link, as DataLad leaves annexed files without content
+    store = tmp_path / 'store'
+    zip_dir = tmp_path / 'ds' / 'derivatives'
+    os.makedirs(store / '.dropped')
+    os.makedirs(zip_dir)
+    for i in range(N_ZIPS):
+        make_zip(store / zip_name(i), i)
+        os.symlink(store / '.dropped' / zip_name(i), zip_dir / zip_name(i))
+    return store, zip_dir
+
+
+def test_fetch_window_bounds_disk_use(tmp_path):
+    store, zip_dir = make_dataset(tmp_path)
+    fetcher = CountingFetcher(store, zip_dir)
+    n_workers, prefetch = 2, 1
+    all_stats = run_pipeline(SPEC, tmp_path / 'ds', n_workers=n_workers,
+                             fetcher=fetcher, prefetch=prefetch)
+
+    assert 0 < fetcher.most_on_disk <= n_workers + prefetch
+    assert fetcher.on_disk() == 0
+    assert not any(stats.failed for stats in all_stats)
+    assert extracted(tmp_path) == [qc_name(i) for i in range(N_ZIPS)]
+
+
+def test_failed_fetch_skips_only_that_archive(tmp_path):
+    store, zip_dir = make_dataset(tmp_path)
+    fetcher = CountingFetcher(store, zip_dir, missing=[zip_name(3)])
+    all_stats = run_pipeline(SPEC, tmp_path / 'ds', n_workers=2,
+                             fetcher=fetcher, prefetch=1)
+
+    failed = [failure for stats in all_stats for failure in stats.failed]
+    assert [os.path.basename(f.zip_path) for f in failed] == [zip_name(3)]
+    assert failed[0].error.startswith('fetch failed')
+    assert extracted(tmp_path) == [qc_name(i) for i in range(N_ZIPS)
+                                   if i != 3]
+
+
+def corrupt(zip_path, member):
+    # flip the first byte of a stored member, leaving its recorded CRC as is
+    with zipfile.ZipFile(zip_path) as zf:
+        offset = zf.getinfo(member).header_offset
+    with open(zip_path, 'r+b') as f:
+        f.seek(offset + 26)
+        name_length, extra_length = struct.unpack('<HH', f.read(4))
+        f.seek(offset + 30 + name_length + extra_length)
+        byte = f.read(1)[0]
+        f.seek(-1, os.SEEK_CUR)
+        f.write(bytes([byte ^ 0xff]))
+
+
+def test_crc_mismatch_is_reported(tmp_path):
+    zip_dir = make_zips(tmp_path)
+    member = 'test/sub-03/ses-1/' + qc_name(3)
+    corrupt(zip_dir / zip_name(3), member)
+    with ExtractionManifest(str(tmp_path / 'manifest.sqlite')) as manifest:
+        all_stats = run_pipeline(SPEC, tmp_path / 'ds', n_workers=2,
+                                 manifest=manifest)
+        assert manifest.entries(tmp_path / 'ds' / 'extracted',
+                                zip_dir / zip_name(3)) == {}
+
+    report = tmp_path / 'unzip_failures.tsv'
+    write_failure_report(report, [('test',) + tuple(failure)
+                                  for stats in all_stats
+                                  for failure in stats.failed])
+    with open(report, newline='') as f:
+        rows = list(csv.DictReader(f, delimiter='\t'))
+    assert [(row['zip_path'], row['member']) for row in rows] == [
+        (str(zip_dir / zip_name(3)), member)]
+    assert rows[0]['expected_size'] == str(len('a\tb\n3\t3\n'))
+    assert 'CRC' in rows[0]['error']
+    # the corrupt member is neither moved into place nor left behind
+    assert extracted(tmp_path) == [qc_name(i) for i in range(N_ZIPS)
+                                   if i != 3]
+
+
+def test_qc_filter_skips_failed_and_excluded_scans(tmp_path):
+    make_zips(tmp_path)
+    summary = tmp_path / 'qc_summary.csv'
+    with open(summary, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['subject', 'session', 'T1 QC'])
+        writer.writerows([['sub-01', 'ses-1', 'fail'],
+                          ['sub-02', 'ses-1', 'artifact'],
+                          ['sub-04', 'ses-1', ''],
+                          ['sub-05', 'ses-1', 'pass']])
+    excluded = tmp_path / 'excluded_scans_T1.csv'
+    with open(excluded, 'w', newline='') as f:
+        f.write('excluded_scans\nsub-07_ses-1\nsub-0\n')
+    keep = QCFilter('T1', ['pass', 'artifact'],
+                    summary=read_qc_summary(summary),
+                    excluded_scans=read_excluded_scans(excluded))
+    all_stats = run_pipeline(SPEC, tmp_path / 'ds', n_workers=2, keep=keep)
+
+    assert sum(stats.matched for stats in all_stats) == N_ZIPS - 2
+    assert extracted(tmp_path) == [qc_name(i) for i in range(N_ZIPS)
+                                   if i not in (1, 7)]
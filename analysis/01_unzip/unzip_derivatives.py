@@ -0,0 +1,203 @@
+import os
+import csv
+import argparse
+from collections import deque
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                ThreadPoolExecutor, wait)
+
+from babs_zip import (PIPELINES, ArchiveStats, ExtractFailure, MemberMatcher,
+                      datapath, extract_archive, is_current, list_archives)
+from extraction_manifest import ExtractionManifest, default_manifest
+from fetchers import DataladFetcher, PresentFetcher
+from qc_filter import MODALITY_COLUMNS, QCFilter, read_excluded_scans
+from zip_index import ZipIndex, default_index
+
+# Unzip the files we need from the BABS output zips of one or more pipelines.
+# Each pipeline is described by a PipelineSpec in babs_zip.py (zip glob,
+# wanted file suffixes, destination), and archives are extracted across a
+# pool of worker processes.
+#
+# e.g. python unzip_derivatives.py xcpd_4 qsiprep --n-workers 8
+#
+# The member list of every archive is cached in a local index (zip_index.py),
+# and every extracted file is recorded in a manifest (extraction_manifest.py).
+# Re-runs only extract members that are new, changed in the archive, or whose
+# copy on disk no longer matches; archives with nothing left to do are
+# skipped without being opened. An interrupted run resumes where it stopped.
+#
+# Every member is checked against the size and CRC in the archive while it is
+# written, and only moved into place if it matches. Members that fail are
+# listed in a tab-separated report (--report) and left out of the manifest,
+# so the next run re-extracts just those.
+#
+# With --datalad, each archive is fetched with 'datalad get' just before it
+# is needed and dropped once extracted. Up to --prefetch archives are fetched
+# ahead of the ones being extracted, so fetching overlaps with decompression
+# while at most n_workers + prefetch archives take up disk space at a time.
+# Without it, the zips must already be retrieved with 'datalad get'. An
+# archive that cannot be fetched is listed in the report and skipped.
+
+
+def report(stats):
+    print('\nFiles in %s done! (%d of %d members matched, %d up to date)'
+          % (stats.zip_path, stats.matched, stats.scanned, stats.skipped))
+    for failure in stats.failed:
+        print('  FAILED %s: %s' % (failure.member or '(archive)',
+                                   failure.error))
+    return stats
+
+
+def write_failure_report(path, failures):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f, delimiter='\t')
+        writer.writerow(('pipeline',) + ExtractFailure._fields)
+        writer.writerows(failures)
+
+
+def run_pipeline(spec, root=datapath, n_workers=1, index=None,
+                 manifest=None, force=False, fetcher=None, prefetch=2,
+                 keep=None):
+    file_list = list_archives(spec, root)
+    dest = os.path.join(root, spec.dest)
+    print('%s: %d archives' % (spec.name, len(file_list)))
+
+    matcher = MemberMatcher(spec.suffixes)
+    all_stats = []
+    todo = []
+    for zip_path in file_list:
+        cached = index.lookup(zip_path) if index is not None else None
+        done = {}
+        if manifest is not None and not force:
+            done = manifest.entries(dest, zip_path)
+        if cached is not None:
+            wanted = [r for r in cached if matcher.match(r.name)
+                      and (keep is None or keep(r.name))]
+            if all(is_current(done.get(r.name), r) for r in wanted):
+                all_stats.append(ArchiveStats(zip_path, len(cached),
+                                              len(wanted), len(wanted),
+                                              None, None, [], []))
+                continue
+        todo.append((zip_path, done, cached is None))
+
+    def finish(stats, refresh):
+        if index is not None and refresh and stats.members is not None:
+            index.store(stats.zip_path, stats.members, stats.key)
+        if manifest is not None:
+            manifest.record(dest, stats.zip_path, stats.extracted)
+        all_stats.append(report(stats))
+
+    if fetcher is None:
+        fetcher = PresentFetcher()
+    # extract in-process when running serially, which is easier to debug
+    if n_workers <= 1:
+        pool = ThreadPoolExecutor(max_workers=1)
+    else:
+        pool = ProcessPoolExecutor(max_workers=n_workers)
+    window = max(n_workers, 1) + prefetch
+
+    # a single thread runs every get and drop, so fetches overlap with
+    # extraction but the fetcher never sees two calls at once
+    with ThreadPoolExecutor(max_workers=1) as getter, pool:
+        pending = deque(todo)
+        fetching = {}
+        extracting = {}
+        dropping = []
+        while pending or fetching or extracting:
+            on_disk = (len(fetching) + len(extracting)
+                       + sum(not future.done() for future in dropping))
+            while pending and on_disk < window:
+                on_disk += 1
+                item = pending.popleft()
+                fetching[getter.submit(fetcher.get, item[0])] = item
+            finished, _ = wait(list(fetching) + list(extracting),
+                               return_when=FIRST_COMPLETED)
+            for future in finished:
+                if future in fetching:
+                    zip_path, done, refresh = fetching.pop(future)
+                    try:
+                        future.result()
+                    except Exception as err:
+                        # reported like an archive that cannot be opened,
+                        # and the other archives carry on
+                        failure = ExtractFailure(zip_path, '', None, None,
+                                                 None, None,
+                                                 'fetch failed: %r' % err)
+                        finish(ArchiveStats(zip_path, 0, 0, 0, None, None,
+                                            [], [failure]), False)
+                        continue
+                    extracting[pool.submit(extract_archive, zip_path,
+                                           spec.suffixes, dest, done,
+                                           keep)] = (zip_path, refresh)
+                else:
+                    zip_path, refresh = extracting.pop(future)
+                    finish(future.result(), refresh)
+                    dropping.append(getter.submit(fetcher.drop, zip_path))
+        for future in dropping:
+            future.result()
+    return all_stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Extract derivative files from BABS output zips.')
+    parser.add_argument('pipelines', nargs='+', choices=sorted(PIPELINES),
+                        help='pipeline specs to run (see babs_zip.py)')
+    parser.add_argument('--n-workers', type=int, default=4,
+                        help='number of archives to extract in parallel')
+    parser.add_argument('--datapath', default=datapath,
+                        help='root of the EF dataset')
+    parser.add_argument('--index', default=default_index,
+                        help='path of the zip member index')
+    parser.add_argument('--no-index', action='store_true',
+                        help='do not read or update the zip member index')
+    parser.add_argument('--manifest', default=default_manifest,
+                        help='path of the extraction manifest')
+    parser.add_argument('--force', action='store_true',
+                        help='re-extract every member, ignoring the manifest')
+    parser.add_argument('--datalad', action='store_true',
+                        help='datalad get each zip before extracting it and '
+                             'drop it afterwards')
+    parser.add_argument('--prefetch', type=int, default=2,
+                        help='number of zips to fetch ahead of extraction')
+    parser.add_argument('--report', default='unzip_failures.tsv',
+                        help='where to write the list of members that failed '
+                             'size/CRC verification')
+    parser.add_argument('--qc-modality', choices=sorted(MODALITY_COLUMNS),
+                        help='only extract scans whose QC status for this '
+                             'modality in qc_summary.csv is in --qc-status')
+    parser.add_argument('--qc-status', nargs='+', default=['pass'],
+                        help='QC statuses to extract (default: pass)')
+    parser.add_argument('--exclude-scans', nargs='+', default=[],
+                        help='excluded_scans_*.csv lists of scans to skip')
+    args = parser.parse_args()
+
+    keep = None
+    if args.qc_modality or args.exclude_scans:
+        excluded = set()
+        for path in args.exclude_scans:
+            excluded |= read_excluded_scans(path)
+        keep = QCFilter(args.qc_modality, args.qc_status,
+                        excluded_scans=excluded)
+
+    fetcher = DataladFetcher(args.datapath) if args.datalad else None
+
+    index = None if args.no_index else ZipIndex(args.index)
+    manifest = ExtractionManifest(args.manifest)
+    failures = []
+    for name in args.pipelines:
+        all_stats = run_pipeline(PIPELINES[name], args.datapath,
+                                 args.n_workers, index, manifest, args.force,
+                                 fetcher, args.prefetch, keep)
+        print('%s: scanned %d members, matched %d, extracted %d, failed %d'
+              % (name, sum(s.scanned for s in all_stats),
+                 sum(s.matched for s in all_stats),
+                 sum(len(s.extracted) for s in all_stats),
+                 sum(len(s.failed) for s in all_stats)))
+        failures += [(name,) + tuple(failure)
+                     for s in all_stats for failure in s.failed]
+    write_failure_report(args.report, failures)
+    if failures:
+        print('%d members failed, see %s' % (len(failures), args.report))
+    if index is not None:
+        index.close()
+    manifest.close()
@@ -0,0 +1,111 @@
+import os
+import sqlite3
+import argparse
+
+from babs_zip import MemberRecord, archive_key
+
+# Local cache of the central directories of the BABS output zips.
+# Each archive is keyed by its path, size and mtime; when any of these change
+# the archive's entries are rebuilt the next time it is looked up. Queries
+# such as "which sessions have a relmat for atlas X" are answered from the
+# cache alone without opening a single zip, e.g.
+#
+#   python zip_index.py '*seg-4S456Parcels*relmat.tsv'
+
+default_index = os.path.join(os.path.expanduser('~'), '.cache',
+                             'babs_zip_index.sqlite')
+
+_schema = '''
+CREATE TABLE IF NOT EXISTS archives (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS members (
+    archive TEXT NOT NULL REFERENCES archives(path) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    file_size INTEGER NOT NULL,
+    crc INTEGER NOT NULL,
+    PRIMARY KEY (archive, name)
+);
+CREATE INDEX IF NOT EXISTS members_name ON members(name);
+'''
+
+
+class ZipIndex:
+    """SQLite cache of archive member names, sizes and CRCs."""
+
+    def __init__(self, db_path=default_index):
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute('PRAGMA foreign_keys = ON')
+        self.conn.executescript(_schema)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def lookup(self, zip_path):
+        """Cached members of an archive, or None if missing or out of date.
+
+        Archives that are not present on disk (e.g. after 'datalad drop')
+        cannot have changed under us, so their cached entries are returned.
+        """
+        zip_path = os.path.abspath(zip_path)
+        row = self.conn.execute(
+            'SELECT size, mtime_ns FROM archives WHERE path = ?',
+            (zip_path,)).fetchone()
+        if row is None:
+            return None
+        try:
+            if archive_key(zip_path) != tuple(row):
+                return None
+        except FileNotFoundError:
+            pass
+        return [MemberRecord(*r) for r in self.conn.execute(
+            'SELECT name, file_size, crc FROM members WHERE archive = ? '
+            'ORDER BY rowid', (zip_path,))]
+
+    def store(self, zip_path, records, key=None):
+        zip_path = os.path.abspath(zip_path)
+        size, mtime_ns = key if key is not None else archive_key(zip_path)
+        with self.conn:
+            self.conn.execute('DELETE FROM archives WHERE path = ?',
+                              (zip_path,))
+            self.conn.execute('INSERT INTO archives VALUES (?, ?, ?)',
+                              (zip_path, size, mtime_ns))
+            self.conn.executemany(
+                'INSERT INTO members VALUES (?, ?, ?, ?)',
+                [(zip_path,) + tuple(r) for r in records])
+
+    def find(self, pattern, archive_glob='*'):
+        """(archive, member) rows whose member name matches a glob."""
+        return [(archive, MemberRecord(name, file_size, crc))
+                for archive, name, file_size, crc in self.conn.execute(
+                    'SELECT archive, name, file_size, crc FROM members '
+                    'WHERE name GLOB ? AND archive GLOB ? '
+                    'ORDER BY archive, name', (pattern, archive_glob))]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Query the cached member lists of the BABS zips.')
+    parser.add_argument('pattern',
+                        help="glob for member names, "
+                             "e.g. '*seg-4S456Parcels*'")
+    parser.add_argument('--archives', default='*',
+                        help='glob restricting which archives to search')
+    parser.add_argument('--index', default=default_index,
+                        help='path of the index database')
+    args = parser.parse_args()
+
+    with ZipIndex(args.index) as index:
+        for archive, member in index.find(args.pattern, args.archives):
+            print('%s\t%s' % (os.path.basename(archive), member.name))
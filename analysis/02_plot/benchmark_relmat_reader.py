@@ -0,0 +1,69 @@
+import os
+import argparse
+import time
+from glob import glob
+
+import numpy as np
+import pandas as pd
+
+from connectivity import RelmatReader, read_relmat
+from edge_store import relmat_glob, xcpd_dir
+
+# Time RelmatReader against the pd.read_table(...).to_numpy() path used so
+# far, on the first --n-files relmats of an atlas (best of --repeat runs),
+# and check that both agree.
+#
+# e.g. python benchmark_relmat_reader.py --atlas 4S1056Parcels \
+#          --n-files 200 --n-threads 8
+
+
+def timed(label, n_files, func, repeat):
+    # Best of repeat runs
+    elapsed = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        arrs = func()
+        elapsed = min(elapsed, time.perf_counter() - start)
+    print(f"{label:<32} {elapsed:8.2f} s  "
+          f"{elapsed / n_files * 1000:8.1f} ms/file")
+    return arrs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the relmat readers.")
+    parser.add_argument("--atlas", default="4S1056Parcels")
+    parser.add_argument("--xcpd-dir", default=xcpd_dir)
+    parser.add_argument("--n-files", type=int, default=100)
+    parser.add_argument("--n-threads", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    relmats = sorted(glob(relmat_glob(args.atlas, args.xcpd_dir)))
+    relmats = relmats[:args.n_files]
+    if not relmats:
+        raise SystemExit(f"No relmats found for atlas {args.atlas}")
+    n = len(relmats)
+    dseg_df = pd.read_table(os.path.join(
+        args.xcpd_dir, "atlases", f"atlas-{args.atlas}",
+        f"atlas-{args.atlas}_dseg.tsv",
+    ))
+    reader = RelmatReader(dseg_df["label"], n_threads=args.n_threads)
+    print(f"{n} relmats, {len(reader.nodes)} nodes, {args.n_threads} threads")
+
+    expected = timed("pd.read_table", n,
+                     lambda: [read_relmat(path) for path in relmats],
+                     args.repeat)
+    candidates = {
+        "RelmatReader, 1 thread":
+            lambda: [reader.read(path) for path in relmats],
+        "RelmatReader, chunked rows":
+            lambda: [reader(path) for path in relmats],
+        "RelmatReader.read_many": lambda: list(reader.read_many(relmats)),
+    }
+    for label, func in candidates.items():
+        arrs = timed(label, n, func, args.repeat)
+        if not all(np.array_equal(a, b, equal_nan=True)
+                   for a, b in zip(expected, arrs)):
+            raise SystemExit(f"{label} does not match pd.read_table")
+    print("All readers match pd.read_table")
@@ -0,0 +1,164 @@
+import os
+import argparse
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+
+import numpy as np
+import pandas as pd
+
+from connectivity import ENTITIES, motion_file, scan_entities
+from edge_store import xcpd_dir
+
+# Recompute the XCP-D correlation matrices at other censoring levels: each
+# run's parcellated time series and _motion.tsv are read once, and frames
+# with framewise displacement above each of --thresholds are dropped. Every
+# threshold gets its own XCP-D-like tree under --out-dir (fd-<threshold>/,
+# with the atlases' dseg files and the relmats under sub-*/ses-*/func/), so
+# the group figures can be made from it directly, e.g.
+#
+#   python censor_relmats.py --atlas 4S1056Parcels \
+#       --thresholds 0.2 0.3 0.5 --n-workers 8
+#   python plot_corrmat.py --xcpd-dir <out-dir>/fd-0.2/ --label fd-0.2
+#
+# The number of frames kept per run and threshold is written to
+# atlas-<atlas>_censoring.tsv in --out-dir, with the reason for every relmat
+# that was not written (too few frames left, or a motion file whose length
+# does not match the time series; such runs are skipped, the others go on).
+
+# CUBIC project path
+censored_dir = ("/cbica/projects/executive_function/EF_dataset_figures/"
+                "censored_xcpd/")
+
+
+def timeseries_glob(atlas, xcpd_dir=xcpd_dir):
+    return os.path.join(xcpd_dir, "sub-*", "ses-*", "func",
+                        f"*seg-{atlas}_stat-mean_timeseries.tsv")
+
+
+def censored_correlations(timeseries, fd, thresholds):
+    """Correlation matrices (thresholds x nodes x nodes) over the frames with
+    fd at or below each threshold, and the number of frames kept.
+
+    The means of all thresholds come from one product of the frame masks
+    with the time series; each threshold then takes one product of its
+    masked, centred time series with itself. Nodes with a NaN in a kept
+    frame, or no variance, get NaN rows and columns.
+    """
+    x = np.asarray(timeseries, dtype=np.float64)
+    valid = ~np.isnan(x)
+    x = np.where(valid, x, 0)
+    fd = np.nan_to_num(np.asarray(fd, dtype=np.float64))
+    keep = fd[None, :] <= np.asarray(thresholds)[:, None]
+    n_kept = keep.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = (keep @ x) / n_kept[:, None]
+    out = np.full((len(thresholds), x.shape[1], x.shape[1]), np.nan)
+    for i, mask in enumerate(keep):
+        if n_kept[i] < 2:
+            continue
+        centred = (x - means[i]) * mask[:, None]
+        cov = centred.T @ centred
+        sd = np.sqrt(np.diag(cov))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            corr = np.clip(cov / np.outer(sd, sd), -1, 1)
+        np.fill_diagonal(corr, 1)
+        bad = (~valid[mask]).any(axis=0) | (sd == 0)
+        corr[bad, :] = np.nan
+        corr[:, bad] = np.nan
+        out[i] = corr
+    return out, n_kept
+
+
+def relmat_name(timeseries_path):
+    return os.path.basename(timeseries_path).replace(
+        "_stat-mean_timeseries.tsv", "_stat-pearsoncorrelation_relmat.tsv")
+
+
+def threshold_dir(out_dir, threshold):
+    return os.path.join(out_dir, f"fd-{threshold:g}")
+
+
+def _censor_run(path, thresholds, out_dir, min_frames):
+    # Worker: write the relmats of one run for every threshold
+    timeseries = pd.read_table(path)
+    fd = pd.read_table(motion_file(path))["framewise_displacement"]
+    entities = scan_entities(path)
+    if len(fd) != len(timeseries):
+        reason = (f"{len(timeseries)} frames but {len(fd)} "
+                  f"in the motion file")
+        return [
+            {**entities, "threshold": threshold, "n_frames": len(timeseries),
+             "n_kept": 0, "written": False, "reason": reason}
+            for threshold in thresholds
+        ]
+    corrs, n_kept = censored_correlations(timeseries, fd, thresholds)
+    rows = []
+    for threshold, corr, n in zip(thresholds, corrs, n_kept):
+        written = n >= max(min_frames, 2)
+        if written:
+            func_dir = os.path.join(threshold_dir(out_dir, threshold),
+                                    f"sub-{entities['sub']}",
+                                    f"ses-{entities['ses']}", "func")
+            os.makedirs(func_dir, exist_ok=True)
+            relmat = pd.DataFrame(corr, index=timeseries.columns,
+                                  columns=timeseries.columns)
+            relmat.to_csv(os.path.join(func_dir, relmat_name(path)),
+                          sep="\t", index_label="Node", na_rep="n/a")
+        reason = "" if written else f"{n} frames left"
+        rows.append({**entities, "threshold": threshold,
+                     "n_frames": len(fd), "n_kept": n, "written": written,
+                     "reason": reason})
+    return rows
+
+
+def censor_relmats(atlas, thresholds, xcpd_dir=xcpd_dir, out_dir=censored_dir,
+                   min_frames=0, n_workers=1):
+    """Write the relmats of every run of an atlas at each threshold; returns
+    the frames kept per run and threshold."""
+    paths = sorted(glob(timeseries_glob(atlas, xcpd_dir)))
+    dseg_file = os.path.join(xcpd_dir, "atlases", f"atlas-{atlas}",
+                             f"atlas-{atlas}_dseg.tsv")
+    for threshold in thresholds:
+        atlas_dir = os.path.join(threshold_dir(out_dir, threshold), "atlases",
+                                 f"atlas-{atlas}")
+        os.makedirs(atlas_dir, exist_ok=True)
+        shutil.copy(dseg_file, atlas_dir)
+    args = (paths, [thresholds] * len(paths), [out_dir] * len(paths),
+            [min_frames] * len(paths))
+    if n_workers <= 1:
+        runs = list(map(_censor_run, *args))
+    else:
+        with ProcessPoolExecutor(n_workers) as pool:
+            runs = list(pool.map(_censor_run, *args, chunksize=8))
+    report = pd.DataFrame([row for rows in runs for row in rows])
+    return report.reindex(columns=ENTITIES + ["threshold", "n_frames",
+                                              "n_kept", "written", "reason"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Recompute XCP-D relmats at other FD censoring "
+                    "thresholds.")
+    parser.add_argument("--atlas", nargs="+", default=["4S1056Parcels"])
+    parser.add_argument("--thresholds", nargs="+", type=float,
+                        default=[0.2, 0.3, 0.5], help="FD thresholds (mm)")
+    parser.add_argument("--min-frames", type=int, default=0,
+                        help="skip runs with fewer frames left")
+    parser.add_argument("--xcpd-dir", default=xcpd_dir)
+    parser.add_argument("--out-dir", default=censored_dir)
+    parser.add_argument("--n-workers", type=int, default=1)
+    args = parser.parse_args()
+
+    for atlas in args.atlas:
+        report = censor_relmats(atlas, args.thresholds, args.xcpd_dir,
+                                args.out_dir, args.min_frames, args.n_workers)
+        report.to_csv(
+            os.path.join(args.out_dir, f"atlas-{atlas}_censoring.tsv"),
+            sep="\t", index=False, na_rep="n/a",
+        )
+        for threshold, runs in report.groupby("threshold"):
+            print(f"{atlas} FD <= {threshold:g}: {runs['written'].sum()} of "
+                  f"{len(runs)} runs written, median "
+                  f"{runs['n_kept'].median():.0f} of "
+                  f"{runs['n_frames'].median():.0f} frames kept")
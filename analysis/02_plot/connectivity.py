@@ -0,0 +1,515 @@
+import io
+import os
+import re
+import hashlib
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# Shared helpers for the XCP-D connectivity figures (plot_corrmat.py,
+# edge_store.py).
+
+relmat_cache_dir = os.path.join(os.path.expanduser("~"), ".cache",
+                                "relmat_cache")
+
+# Subcortical atlases are shown as a single network each
+ATLAS_MAPPER = {
+    "CIT168Subcortical": "Subcortical",
+    "ThalamusHCP": "Thalamus",
+    "SubcorticalHCP": "Subcortical",
+}
+
+
+def network_labels(dseg_df):
+    labels = dseg_df["network_label"].fillna(dseg_df["atlas_name"]).tolist()
+    return [ATLAS_MAPPER.get(net, net) for net in labels]
+
+
+def community_layout(network_labels):
+    """Node order grouping networks, and where to draw/label them.
+
+    Returns community_order (node order, networks kept in order of first
+    appearance), unique_labels (network names in that order), break_idx
+    (positions of the community-separating lines) and label_idx (tick
+    positions for the network names).
+    """
+    # Number networks in order of first appearance, then sort nodes on
+    # "<number>_<network>" as the figures always have
+    codes, unique_labels = pd.factorize(np.asarray(network_labels))
+    unique_labels = list(unique_labels)
+    mapped_network_labels = [f"{code:03d}_{label}"
+                             for code, label in zip(codes, network_labels)]
+    community_order = np.argsort(mapped_network_labels)
+
+    # Lines go halfway between the last node of a network and the first
+    # node of the next one
+    ends = np.cumsum(np.bincount(codes, minlength=len(unique_labels)))
+    starts = ends - np.bincount(codes, minlength=len(unique_labels))
+    break_idx = np.concatenate(
+        ([0], (starts[1:] + ends[:-1] - 1) / 2, [len(codes)]))
+
+    # Label positions
+    label_idx = (break_idx[1:] + break_idx[:-1]) / 2
+    return community_order, unique_labels, break_idx, label_idx
+
+
+class NetworkBlocks:
+    """Network x network summaries of parcel x parcel connectivity.
+
+    Edges are taken from the upper triangle (diagonal excluded, in
+    np.triu_indices order, as in edge_store.py) and sorted once by the pair
+    of networks they join, so each block is one contiguous segment that is
+    reduced over the last axis in one go for every scan. This works on one
+    edge vector or a whole scans x edges stack at once; NaN edges are left
+    out of their block. Blocks without edges (the diagonal block of a
+    single-node network) come out as NaN.
+    """
+
+    def __init__(self, network_labels):
+        codes, networks = pd.factorize(np.asarray(network_labels))
+        self.networks = list(networks)
+        self.n_nodes = len(codes)
+        n_networks = len(self.networks)
+
+        rows, cols = np.triu_indices(self.n_nodes, k=1)
+        block = (np.minimum(codes[rows], codes[cols]) * n_networks
+                 + np.maximum(codes[rows], codes[cols]))
+        self.order = np.argsort(block, kind="stable")
+        block = block[self.order]
+        self.starts = np.flatnonzero(
+            np.concatenate(([True], block[1:] != block[:-1])))
+        self.ends = np.append(self.starts[1:], len(block))
+        self.block_rows, self.block_cols = np.divmod(block[self.starts],
+                                                     n_networks)
+
+    def _square(self, values):
+        n_networks = len(self.networks)
+        out = np.full(values.shape[:-1] + (n_networks, n_networks), np.nan)
+        out[..., self.block_rows, self.block_cols] = values
+        out[..., self.block_cols, self.block_rows] = values
+        return out
+
+    def block_stats(self, edges):
+        """Per-block edge count, mean and SD (as np.nanstd), one value per
+        block."""
+        edges = np.asarray(edges)[..., self.order]
+        shape = edges.shape[:-1] + (len(self.starts),)
+        count = np.zeros(shape, dtype=np.int64)
+        mean = np.full(shape, np.nan)
+        sd = np.full(shape, np.nan)
+        # Summing each segment as a slice beat np.add.reduceat over the
+        # whole stack several times over
+        for i, (start, end) in enumerate(zip(self.starts, self.ends)):
+            segment = edges[..., start:end]
+            valid = ~np.isnan(segment)
+            n = valid.sum(axis=-1)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                total = np.where(valid, segment, 0).sum(axis=-1,
+                                                        dtype=np.float64)
+                m = total / n
+                dev = np.where(valid, segment - m[..., None], 0)
+                sd[..., i] = np.sqrt((dev * dev).sum(axis=-1) / n)
+            count[..., i] = n
+            mean[..., i] = m
+        return count, mean, sd
+
+    def summarize(self, edges):
+        """Network x network mean and SD matrices for edge vector(s)."""
+        _, mean, sd = self.block_stats(edges)
+        return self._square(mean), self._square(sd)
+
+    def summarize_matrix(self, matrices):
+        """As summarize(), for parcel x parcel matrices."""
+        matrices = np.asarray(matrices)
+        rows, cols = np.triu_indices(self.n_nodes, k=1)
+        return self.summarize(matrices[..., rows, cols])
+
+
+ENTITIES = ["sub", "ses", "task", "acq", "run"]
+_entity = re.compile(r"(?:^|_)(sub|ses|task|acq|run)-([^_]+)")
+
+
+def scan_entities(path):
+    found = dict(_entity.findall(os.path.basename(path)))
+    return {entity: found.get(entity, "n/a") for entity in ENTITIES}
+
+
+def motion_file(path):
+    """The XCP-D *_motion.tsv of the run a relmat belongs to."""
+    return path.split("_space-")[0] + "_motion.tsv"
+
+
+def read_excluded(csv_file, column):
+    df = pd.read_csv(csv_file)
+    return set(df[column].astype(str).str.strip())
+
+
+def is_excluded(path, excluded_scans):
+    # excluded_scans holds IDs such as sub-20212_ses-1_task-nback_run-02,
+    # matched against the file name or a whole sub-*/ses-* folder
+    parts = path.split("/")
+    if excluded_scans.intersection(parts[:-1]):
+        return True
+    return any(parts[-1].startswith(f"{scan}_") for scan in excluded_scans)
+
+
+# Correlations are clipped before the Fisher z-transform so that r = +/-1
+# (e.g. on the diagonal) stays finite
+R_CLIP = 0.999999
+
+
+def fisher_z(r, out=None):
+    out = np.clip(r, -R_CLIP, R_CLIP, out=out)
+    return np.arctanh(out, out=out)
+
+
+def file_id(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+class FisherZAccumulator:
+    """Streaming NaN-aware mean and SD of Fisher z-transformed matrices.
+
+    Only the sufficient statistics are kept: per entry, the number of
+    non-NaN values, the sum of z and the sum of z squared. Matrices can be
+    added or removed one at a time and accumulators merged or subtracted,
+    so group statistics follow the cohort as scans come and go without
+    revisiting the rest. mean() matches np.nanmean over the stacked
+    z-transformed matrices; std() matches np.nanstd to about 1e-6 (see std).
+
+    scans maps each relmat in the statistics to its file_id(); save() and
+    load() keep both in a .npz file.
+    """
+
+    def __init__(self, shape=None):
+        self.shape = None
+        self.n = 0
+        self.scans = {}
+        if shape is not None:
+            self._allocate(shape)
+
+    def _allocate(self, shape):
+        self.shape = tuple(shape)
+        self.count = np.zeros(self.shape, dtype=np.int64)
+        self.sum_z = np.zeros(self.shape)
+        self.sum_z2 = np.zeros(self.shape)
+
+    def _check_shape(self, shape):
+        if self.shape is None:
+            self._allocate(shape)
+        elif tuple(shape) != self.shape:
+            raise ValueError(f"Matrix shape {tuple(shape)} does not match "
+                             f"{self.shape}")
+
+    def _update(self, r, sign):
+        r = np.asarray(r, dtype=np.float64)
+        self._check_shape(r.shape)
+        z = fisher_z(r, out=np.empty(self.shape))
+        valid = ~np.isnan(z)
+        z[~valid] = 0
+        self.count += sign * valid
+        self.sum_z += sign * z
+        z *= z
+        self.sum_z2 += sign * z
+        self.n += sign
+
+    def add(self, r):
+        self._update(r, 1)
+
+    def remove(self, r):
+        """Take out a matrix that was added before."""
+        self._update(r, -1)
+
+    def merge(self, other, sign=1):
+        """Fold in another accumulator (or take it out, with sign=-1)."""
+        if other.shape is None:
+            return
+        self._check_shape(other.shape)
+        self.count += sign * other.count
+        self.sum_z += sign * other.sum_z
+        self.sum_z2 += sign * other.sum_z2
+        self.n += sign * other.n
+
+    def subtract(self, other):
+        self.merge(other, -1)
+
+    def mean(self):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(self.count > 0, self.sum_z / self.count, np.nan)
+
+    def std(self):
+        """Population SD (ddof=0) from the sums, as sum(z^2) / n - mean^2.
+
+        The subtraction cancels most digits where z is large and nearly
+        constant, e.g. the clipped diagonal (z ~ 7.25), so the result is off
+        by up to a few 1e-7 there, and can even come out slightly negative,
+        which is why the variance is clamped to 0.
+        """
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = self.sum_z / self.count
+            var = np.maximum(self.sum_z2 / self.count - mean * mean, 0)
+            return np.where(self.count > 0, np.sqrt(var), np.nan)
+
+    def save(self, path):
+        paths = sorted(self.scans)
+        ids = np.array([self.scans[p] for p in paths], dtype=np.int64)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(
+                f, n=self.n, count=self.count, sum_z=self.sum_z,
+                sum_z2=self.sum_z2, scans=np.array(paths, dtype=str),
+                file_ids=ids.reshape(-1, 2),
+            )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            acc = cls(f["count"].shape)
+            acc.n = int(f["n"])
+            acc.count[...] = f["count"]
+            acc.sum_z[...] = f["sum_z"]
+            acc.sum_z2[...] = f["sum_z2"]
+            acc.scans = {p: tuple(int(x) for x in i)
+                         for p, i in zip(f["scans"].tolist(), f["file_ids"])}
+        return acc
+
+
+def read_relmat(path):
+    return pd.read_table(path, index_col="Node").to_numpy()
+
+
+class RelmatReader:
+    """Fast reader for the relmat TSVs of one atlas.
+
+    The header line of each file is compared as bytes with the one expected
+    from the atlas labels (the dseg "label" column), built once, and only the
+    numeric block is parsed, as float64 with the Node column dropped. Calling
+    the reader parses a file in row blocks on n_threads threads (pandas' C
+    parser releases the GIL); read_many() reads several files concurrently,
+    one per thread. The result matches read_relmat, so a reader can be used
+    as the RelmatCache loader.
+    """
+
+    def __init__(self, nodes, n_threads=4):
+        self.nodes = list(nodes)
+        self.n_threads = n_threads
+        self.header = "\t".join(["Node"] + self.nodes).encode()
+
+    def _parse(self, block):
+        return pd.read_csv(
+            io.BytesIO(block), sep="\t", header=None, engine="c",
+            usecols=range(1, len(self.nodes) + 1), dtype=np.float64,
+        ).to_numpy()
+
+    def _read_block(self, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        header, _, block = data.partition(b"\n")
+        if header.rstrip(b"\r") != self.header:
+            raise ValueError(f"Node labels in {path} do not match the atlas")
+        return block
+
+    def read(self, path, n_threads=1):
+        block = self._read_block(path)
+        if n_threads <= 1:
+            arr = self._parse(block)
+        else:
+            # One block of about n_nodes / n_threads rows per thread, cut at
+            # line ends
+            chunks = []
+            step = -(-len(block) // n_threads)
+            start = 0
+            while start < len(block):
+                end = block.find(b"\n", start + step) + 1 or len(block)
+                chunks.append(block[start:end])
+                start = end
+            with ThreadPoolExecutor(n_threads) as pool:
+                arr = np.vstack(list(pool.map(self._parse, chunks)))
+        if arr.shape != (len(self.nodes), len(self.nodes)):
+            raise ValueError(f"{path} has shape {arr.shape}, expected "
+                             f"{len(self.nodes)} nodes")
+        return arr
+
+    def __call__(self, path):
+        return self.read(path, self.n_threads)
+
+    def read_many(self, paths):
+        with ThreadPoolExecutor(self.n_threads) as pool:
+            yield from pool.map(self.read, paths)
+
+
+def pconn_glob(atlas):
+    return f"*seg-{atlas}_den-91k_stat-pearsoncorrelation_boldmap.pconn.nii"
+
+
+class PconnReader:
+    """Reader for the pconn.nii CIFTI files XCP-D writes next to the relmats.
+
+    The data are memory-mapped through nibabel's dataobj, so no text is
+    parsed, and the parcel names are taken from the CIFTI parcel axes and
+    checked against the atlas labels (the dseg "label" column). Parcels
+    stored in another order are put in atlas order. Like RelmatReader, a
+    reader can be used as the loader for the group statistics.
+    """
+
+    def __init__(self, nodes):
+        self.nodes = list(nodes)
+
+    def __call__(self, path):
+        import nibabel as nib
+
+        img = nib.load(path, mmap=True)
+        labels = [list(img.header.get_axis(i).name) for i in range(2)]
+        data = np.asanyarray(img.dataobj)
+        if labels[0] == self.nodes and labels[1] == self.nodes:
+            return data
+        if (sorted(labels[0]) != sorted(self.nodes)
+                or sorted(labels[1]) != sorted(self.nodes)):
+            raise ValueError(f"Parcels in {path} do not match the atlas")
+        rows = [labels[0].index(node) for node in self.nodes]
+        cols = [labels[1].index(node) for node in self.nodes]
+        return data[np.ix_(rows, cols)]
+
+
+class RelmatCache:
+    """Parsed relmats saved as .npy, keyed by the file's path, size and mtime.
+
+    load() parses a relmat only the first time it is seen (or after it
+    changes) and afterwards reads the binary copy. Files that change get a
+    new key, so stale copies are never returned; they age out of the cache,
+    which is kept under max_bytes by evicting the least recently used files.
+    """
+
+    def __init__(self, cache_dir=relmat_cache_dir, max_bytes=10 * 2**30,
+                 loader=read_relmat):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.loader = loader
+        os.makedirs(cache_dir, exist_ok=True)
+        self.total_bytes = sum(size for _, size, _ in self._entries())
+
+    def _entries(self):
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".npy"):
+                st = entry.stat()
+                yield entry.path, st.st_size, st.st_mtime_ns
+
+    def cache_path(self, path):
+        st = os.stat(path)
+        key = f"{os.path.abspath(path)}\0{st.st_size}\0{st.st_mtime_ns}"
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        return os.path.join(self.cache_dir, digest + ".npy")
+
+    def load(self, path):
+        cached = self.cache_path(path)
+        try:
+            arr = np.load(cached)
+        except (FileNotFoundError, ValueError, OSError):
+            pass
+        else:
+            # mtime marks the last use, for LRU eviction
+            os.utime(cached)
+            return arr
+
+        arr = self.loader(path)
+        tmp = f"{cached}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, arr)
+        os.replace(tmp, cached)
+        self.total_bytes += os.path.getsize(cached)
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+        return arr
+
+    def evict(self):
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        self.total_bytes = sum(size for _, size, _ in entries)
+        for cached, size, _ in entries:
+            if self.total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(cached)
+            except FileNotFoundError:
+                # Already evicted by another process sharing the cache
+                pass
+            self.total_bytes -= size
+
+
+def _accumulate(items, loader):
+    accumulators = {}
+    for path, groups in items:
+        arr = loader(path)
+        for group in groups:
+            accumulators.setdefault(group, FisherZAccumulator()).add(arr)
+    return accumulators
+
+
+def accumulate_groups(targets, loader=read_relmat, n_workers=1):
+    """Fisher z accumulators for each group.
+
+    targets maps each relmat to the groups it belongs to; every file is read
+    once. With n_workers > 1 the files are shared out over a process pool:
+    each worker folds its files into its own accumulators, and only those
+    are sent back and merged, never the matrices themselves.
+    """
+    items = sorted(targets.items())
+    if n_workers <= 1:
+        return _accumulate(items, loader)
+
+    accumulators = {}
+    with ProcessPoolExecutor(n_workers) as pool:
+        futures = [pool.submit(_accumulate, items[i::n_workers], loader)
+                   for i in range(n_workers)]
+        # Merged in submission order, so results do not depend on timing
+        for future in futures:
+            for group, accumulator in future.result().items():
+                if group in accumulators:
+                    accumulators[group].merge(accumulator)
+                else:
+                    accumulators[group] = accumulator
+    return accumulators
+
+
+def update_groups(accumulators, selected, loader=read_relmat, n_workers=1):
+    """Bring group accumulators up to date with the scans selected now.
+
+    accumulators maps groups to FisherZAccumulators (e.g. loaded from their
+    saved .npz) and is updated in place; selected maps groups to their
+    relmats. Only relmats that are new, changed or no longer selected (e.g.
+    newly excluded) are read, so the work follows the size of the change.
+    A group is rebuilt if a relmat to take out has changed or gone, since
+    its old values can then no longer be subtracted. Returns the number of
+    relmats added and removed per group.
+    """
+    add = defaultdict(list)
+    remove = defaultdict(list)
+    changes = {}
+    for group, paths in selected.items():
+        wanted = {path: file_id(path) for path in paths}
+        accumulator = accumulators.setdefault(group, FisherZAccumulator())
+        stale = [path for path, fid in accumulator.scans.items()
+                 if wanted.get(path) != fid]
+        if any(not os.path.exists(path)
+               or file_id(path) != accumulator.scans[path] for path in stale):
+            accumulator = accumulators[group] = FisherZAccumulator()
+            stale = []
+        new = [path for path, fid in wanted.items()
+               if accumulator.scans.get(path) != fid]
+        for path in stale:
+            remove[path].append(group)
+        for path in new:
+            add[path].append(group)
+        accumulator.scans = wanted
+        changes[group] = (len(new), len(stale))
+
+    added = accumulate_groups(add, loader, n_workers)
+    for group, accumulator in added.items():
+        accumulators[group].merge(accumulator)
+    removed = accumulate_groups(remove, loader, n_workers)
+    for group, accumulator in removed.items():
+        accumulators[group].subtract(accumulator)
+    return changes
@@ -0,0 +1,155 @@
+import os
+import argparse
+from glob import glob
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from connectivity import RelmatReader, scan_entities
+
+# Pack every XCP-D relmat of one atlas into a single memory-mapped
+# scans x edges float32 array holding the upper triangle (diagonal excluded),
+# with a table of the scan entities (sub/ses/task/acq/run) for each row.
+# Analyses can then slice cohorts and edges without parsing text, e.g.
+#
+#   python edge_store.py --atlas 4S1056Parcels
+#
+#   store = EdgeStore("/cbica/.../edge_store/atlas-4S1056Parcels")
+#   rows = store.select(task="rest", run="01")
+#   z = np.arctanh(store.edges[rows])
+
+# CUBIC project paths
+xcpd_dir = ("/cbica/projects/executive_function/EF_dataset/derivatives/"
+            "xcpd_BABS_EF_full_project_outputs/xcpd/")
+store_dir = "/cbica/projects/executive_function/EF_dataset_figures/edge_store/"
+
+
+def relmat_glob(atlas, root=xcpd_dir):
+    return os.path.join(
+        root, "sub-*", "ses-*", "func",
+        f"*seg-{atlas}_stat-pearsoncorrelation_relmat.tsv",
+    )
+
+
+def n_edges(n_nodes):
+    return n_nodes * (n_nodes - 1) // 2
+
+
+def upper_triangle(matrix):
+    return matrix[np.triu_indices(matrix.shape[0], k=1)]
+
+
+def to_square(edges, n_nodes, diagonal=np.nan):
+    """Rebuild symmetric matrices from upper-triangle edge vector(s)."""
+    edges = np.asarray(edges)
+    rows, cols = np.triu_indices(n_nodes, k=1)
+    out = np.full(edges.shape[:-1] + (n_nodes, n_nodes), diagonal,
+                  dtype=edges.dtype)
+    out[..., rows, cols] = edges
+    out[..., cols, rows] = edges
+    return out
+
+
+def _store_rows(edges_path, rows, relmats, nodes):
+    # Parse relmats straight into their rows of the preallocated edges.npy
+    reader = RelmatReader(nodes, n_threads=1)
+    edges = np.load(edges_path, mmap_mode="r+")
+    triu = np.triu_indices(len(nodes), k=1)
+    for row, path in zip(rows, relmats):
+        edges[row] = reader.read(path)[triu]
+    edges.flush()
+
+
+def build_edge_store(relmats, out_dir, n_workers=1, chunk_size=32):
+    """Write edges.npy, scans.tsv and nodes.tsv for a list of relmat files.
+
+    With n_workers > 1, chunks of chunk_size relmats are parsed on a process
+    pool and each worker writes its rows into edges.npy itself.
+    """
+    relmats = sorted(relmats)
+    if not relmats:
+        raise ValueError("No relmat files to store")
+    os.makedirs(out_dir, exist_ok=True)
+
+    nodes = pd.read_table(relmats[0], nrows=0).columns[1:].tolist()
+    edges_path = os.path.join(out_dir, "edges.npy")
+    edges = np.lib.format.open_memmap(
+        edges_path, mode="w+", dtype=np.float32,
+        shape=(len(relmats), n_edges(len(nodes))),
+    )
+    del edges
+    chunks = [
+        (range(start, min(start + chunk_size, len(relmats))),
+         relmats[start:start + chunk_size])
+        for start in range(0, len(relmats), chunk_size)
+    ]
+    if n_workers <= 1:
+        for rows, paths in chunks:
+            _store_rows(edges_path, rows, paths, nodes)
+    else:
+        with ProcessPoolExecutor(n_workers) as pool:
+            futures = [
+                pool.submit(_store_rows, edges_path, rows, paths, nodes)
+                for rows, paths in chunks
+            ]
+            for future in futures:
+                future.result()
+
+    scans = pd.DataFrame([scan_entities(path) for path in relmats])
+    scans["path"] = relmats
+    scans.to_csv(os.path.join(out_dir, "scans.tsv"), sep="\t", index=False)
+    pd.DataFrame({"Node": nodes}).to_csv(
+        os.path.join(out_dir, "nodes.tsv"), sep="\t", index=False
+    )
+
+
+class EdgeStore:
+    """Read-only view of a store written by build_edge_store."""
+
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+        self.edges = np.load(os.path.join(out_dir, "edges.npy"),
+                             mmap_mode="r")
+        self.scans = pd.read_table(os.path.join(out_dir, "scans.tsv"),
+                                   dtype=str, keep_default_na=False)
+        nodes = pd.read_table(os.path.join(out_dir, "nodes.tsv"))
+        self.nodes = nodes["Node"].tolist()
+
+    @property
+    def n_nodes(self):
+        return len(self.nodes)
+
+    def select(self, exclude=(), **entities):
+        """Row numbers of scans matching the given entity values.
+
+        exclude takes scan IDs as in excluded_scans_corrmat.csv
+        (e.g. sub-20212_ses-1_task-nback_run-02).
+        """
+        keep = np.ones(len(self.scans), dtype=bool)
+        for entity, value in entities.items():
+            keep &= (self.scans[entity] == value).to_numpy()
+        if exclude:
+            names = self.scans["path"].map(os.path.basename)
+            prefixes = tuple(scan + "_" for scan in exclude)
+            keep &= ~names.str.startswith(prefixes).to_numpy()
+        return np.flatnonzero(keep)
+
+    def matrix(self, row):
+        return to_square(np.asarray(self.edges[row], dtype=np.float64),
+                         self.n_nodes)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build an XCP-D relmat edge store.")
+    parser.add_argument("--atlas", default="4S1056Parcels")
+    parser.add_argument("--xcpd-dir", default=xcpd_dir)
+    parser.add_argument("--out-dir", default=store_dir)
+    parser.add_argument("--n-workers", type=int, default=1)
+    args = parser.parse_args()
+
+    relmats = glob(relmat_glob(args.atlas, args.xcpd_dir))
+    out_dir = os.path.join(args.out_dir, f"atlas-{args.atlas}")
+    build_edge_store(relmats, out_dir, args.n_workers)
+    print(f"Stored {len(relmats)} relmats in {out_dir}")
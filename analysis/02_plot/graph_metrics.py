@@ -0,0 +1,138 @@
+import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from connectivity import ENTITIES, fisher_z, network_labels
+from edge_store import EdgeStore, store_dir, to_square, xcpd_dir
+
+# Graph metrics for every scan of an edge store (see edge_store.py), on the
+# positive Fisher z weights with the networks of the atlas dseg as modules:
+# node strength, participation coefficient and within-module degree z
+# (Guimera & Amaral, 2005), and system segregation (Chan et al., 2014), e.g.
+#
+#   python graph_metrics.py --atlas 4S1056Parcels --n-workers 8
+#
+# writes graph_metrics_nodes.tsv (one row per scan and node) and
+# graph_metrics_scans.tsv (one row per scan) to the store directory.
+
+
+class GraphMetrics:
+    """Node and system metrics of scans x nodes x nodes weight stacks.
+
+    Everything module-wise goes through the one-hot nodes x modules matrix:
+    W @ modules gives each node's strength to every module, and
+    modules.T @ W @ modules the total weight between every pair of modules,
+    for a whole stack of scans at once.
+    """
+
+    def __init__(self, network_labels):
+        codes, networks = pd.factorize(np.asarray(network_labels))
+        self.networks = np.asarray(networks)[codes]
+        self.codes = codes
+        self.modules = np.eye(len(networks))[codes]
+        self.size = self.modules.sum(axis=0)
+
+    def node_metrics(self, weights):
+        """Strength, participation coefficient and within-module degree z
+        (scans x nodes each)."""
+        strength = weights.sum(axis=-1)
+        to_modules = weights @ self.modules
+        with np.errstate(invalid="ignore", divide="ignore"):
+            fractions = to_modules / strength[..., None]
+            participation = 1 - (fractions ** 2).sum(axis=-1)
+        # Each node's strength to its own module
+        own = np.broadcast_to(self.codes[:, None],
+                              to_modules.shape[:-1] + (1,))
+        within = np.take_along_axis(to_modules, own, axis=-1)[..., 0]
+        mean = (within @ self.modules) / self.size
+        mean_sq = (within ** 2 @ self.modules) / self.size
+        sd = np.sqrt(np.maximum(mean_sq - mean ** 2, 0))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            within_z = (within - mean[..., self.codes]) / sd[..., self.codes]
+        return strength, participation, within_z
+
+    def system_segregation(self, weights):
+        """System segregation with the mean within- and between-system weight
+        (scans each); the diagonal of weights must be 0."""
+        between_modules = self.modules.T @ weights @ self.modules
+        total = between_modules.sum(axis=(-2, -1))
+        within = np.trace(between_modules, axis1=-2, axis2=-1)
+        n_within = (self.size * (self.size - 1)).sum()
+        n_between = len(self.codes) * (len(self.codes) - 1) - n_within
+        mean_within = within / n_within
+        mean_between = (total - within) / n_between
+        segregation = (mean_within - mean_between) / mean_within
+        return segregation, mean_within, mean_between
+
+
+def _scan_metrics(out_dir, start, stop, labels):
+    # Worker: metrics of store scans start:stop, opened from out_dir
+    store = EdgeStore(out_dir)
+    metrics = GraphMetrics(labels)
+    z = fisher_z(np.asarray(store.edges[start:stop], dtype=np.float64))
+    weights = to_square(np.nan_to_num(np.maximum(z, 0)), store.n_nodes,
+                        diagonal=0)
+    strength, participation, within_z = metrics.node_metrics(weights)
+    segregation, mean_within, mean_between = metrics.system_segregation(
+        weights)
+
+    scans = store.scans.iloc[start:stop][ENTITIES].reset_index(drop=True)
+    nodes = scans.loc[scans.index.repeat(store.n_nodes)].reset_index(drop=True)
+    nodes["node"] = np.tile(store.nodes, len(scans))
+    nodes["network"] = np.tile(metrics.networks, len(scans))
+    nodes["strength"] = strength.ravel()
+    nodes["participation"] = participation.ravel()
+    nodes["within_module_z"] = within_z.ravel()
+    scans["system_segregation"] = segregation
+    scans["mean_within"] = mean_within
+    scans["mean_between"] = mean_between
+    return nodes, scans
+
+
+def graph_metrics(out_dir, labels, chunk_size=16, n_workers=1):
+    """Node and scan tables for all scans of the store in out_dir, chunk_size
+    scans per task."""
+    n_scans = len(EdgeStore(out_dir).scans)
+    starts = list(range(0, n_scans, chunk_size))
+    stops = [min(start + chunk_size, n_scans) for start in starts]
+    if n_workers <= 1:
+        tables = [_scan_metrics(out_dir, start, stop, labels)
+                  for start, stop in zip(starts, stops)]
+    else:
+        with ProcessPoolExecutor(n_workers) as pool:
+            tables = list(pool.map(_scan_metrics, [out_dir] * len(starts),
+                                   starts, stops, [labels] * len(starts)))
+    nodes, scans = zip(*tables)
+    return (pd.concat(nodes, ignore_index=True),
+            pd.concat(scans, ignore_index=True))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Per-scan graph metrics from an edge store.")
+    parser.add_argument("--atlas", default="4S1056Parcels")
+    parser.add_argument("--xcpd-dir", default=xcpd_dir)
+    parser.add_argument("--store-dir", default=store_dir)
+    parser.add_argument("--chunk-size", type=int, default=16)
+    parser.add_argument("--n-workers", type=int, default=1)
+    args = parser.parse_args()
+
+    out_dir = os.path.join(args.store_dir, f"atlas-{args.atlas}")
+    store = EdgeStore(out_dir)
+    dseg_df = pd.read_table(os.path.join(
+        args.xcpd_dir, "atlases", f"atlas-{args.atlas}",
+        f"atlas-{args.atlas}_dseg.tsv",
+    ))
+    # Networks in the node order of the store
+    networks = dict(zip(dseg_df["label"], network_labels(dseg_df)))
+    labels = [networks[node] for node in store.nodes]
+
+    nodes, scans = graph_metrics(out_dir, labels, args.chunk_size,
+                                 args.n_workers)
+    for name, table in [("nodes", nodes), ("scans", scans)]:
+        table.to_csv(os.path.join(out_dir, f"graph_metrics_{name}.tsv"),
+                     sep="\t", index=False, na_rep="n/a")
+    print(f"Wrote graph metrics for {len(scans)} scans to {out_dir}")
@@ -0,0 +1,62 @@
+import os
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from connectivity import ENTITIES, NetworkBlocks, fisher_z, network_labels
+from edge_store import EdgeStore, store_dir, xcpd_dir
+
+# Network x network FC for every scan of an edge store (see edge_store.py):
+# the mean and SD of the Fisher z-transformed edges in each network block,
+# as a long table with one row per scan and pair of networks, e.g.
+#
+#   python network_fc.py --atlas 4S1056Parcels
+
+
+def network_fc(store, labels, chunk_size=128):
+    """Block mean/SD of Fisher z for all scans, chunk_size scans at a time."""
+    blocks = NetworkBlocks(labels)
+    n_blocks = len(blocks.starts)
+    tables = []
+    for start in range(0, len(store.scans), chunk_size):
+        z = fisher_z(np.asarray(store.edges[start:start + chunk_size],
+                                dtype=np.float64))
+        count, mean, sd = blocks.block_stats(z)
+        scans = store.scans.iloc[start:start + len(z)]
+        table = scans.loc[scans.index.repeat(n_blocks), ENTITIES]
+        table = table.reset_index(drop=True)
+        table["network_1"] = np.tile(
+            np.take(blocks.networks, blocks.block_rows), len(z))
+        table["network_2"] = np.tile(
+            np.take(blocks.networks, blocks.block_cols), len(z))
+        table["n_edges"] = count.ravel()
+        table["mean_z"] = mean.ravel()
+        table["sd_z"] = sd.ravel()
+        tables.append(table)
+    return pd.concat(tables, ignore_index=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Per-scan network x network FC from an edge store.")
+    parser.add_argument("--atlas", default="4S1056Parcels")
+    parser.add_argument("--xcpd-dir", default=xcpd_dir)
+    parser.add_argument("--store-dir", default=store_dir)
+    parser.add_argument("--chunk-size", type=int, default=128)
+    args = parser.parse_args()
+
+    out_dir = os.path.join(args.store_dir, f"atlas-{args.atlas}")
+    store = EdgeStore(out_dir)
+    dseg_df = pd.read_table(os.path.join(
+        args.xcpd_dir, "atlases", f"atlas-{args.atlas}",
+        f"atlas-{args.atlas}_dseg.tsv",
+    ))
+    # Networks in the node order of the store
+    networks = dict(zip(dseg_df["label"], network_labels(dseg_df)))
+    labels = [networks[node] for node in store.nodes]
+
+    table = network_fc(store, labels, args.chunk_size)
+    out_file = os.path.join(out_dir, "network_fc.tsv")
+    table.to_csv(out_file, sep="\t", index=False, na_rep="n/a")
+    print(f"Wrote network FC for {len(store.scans)} scans to {out_file}")
@@ -0,0 +1,301 @@
+import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from fnmatch import fnmatchcase
+from glob import glob
+import matplotlib as mpl
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+
+from connectivity import (
+    FisherZAccumulator,
+    PconnReader,
+    RelmatCache,
+    RelmatReader,
+    community_layout,
+    is_excluded,
+    network_labels,
+    pconn_glob,
+    read_excluded,
+    scan_entities,
+    update_groups,
+)
+
+# Plot group mean and SD correlation matrices for the fMRI nback and rest runs.
+# Relmats are globbed once, grouped by their task/run entities, and read in a
+# single pass: each file is added to every group it belongs to. The group
+# statistics are saved, so later runs only read the relmats that were added,
+# changed or excluded since (--rebuild starts over). --pconn reads the
+# pconn.nii files XCP-D also writes instead of the relmat TSVs. --xcpd-dir
+# points at another XCP-D-like tree, such as the relmats censor_relmats.py
+# writes; --label keeps its figures and statistics apart.
+#
+# e.g. python plot_corrmat.py --groups nback rest_run-01 --n-workers 8
+#      python plot_corrmat.py --atlas all --n-workers 15
+#      python plot_corrmat.py --xcpd-dir /path/to/censored_xcpd/fd-0.2/ \
+#          --label fd-0.2
+
+# CUBIC project paths
+xcpd_dir = ("/cbica/projects/executive_function/EF_dataset/derivatives/"
+            "xcpd_BABS_EF_full_project_outputs/xcpd/")
+processing_dir = ("/cbica/projects/executive_function/EF_dataset_figures/"
+                  "processing_scripts/")
+figures_dir = ("/cbica/projects/executive_function/EF_dataset_figures/"
+               "figures/fmriprep_figures/")
+group_stats_dir = ("/cbica/projects/executive_function/EF_dataset_figures/"
+                   "group_stats/")
+
+# Figure label -> entities a scan must have to be included (fnmatch patterns,
+# "n/a" for an entity the file name does not have). As in the former
+# plot_corrmat_*.py scripts, nback pools both runs and every acquisition,
+# while the run groups leave out acq-VARIANT* scans (whose file names did not
+# match "task-rest_run-0X"); those scans get groups of their own.
+GROUPS = {
+    "nback": {"task": "nback"},
+    "nback_run-01": {"task": "nback", "acq": "n/a", "run": "01"},
+    "nback_run-02": {"task": "nback", "acq": "n/a", "run": "02"},
+    "rest_run-01": {"task": "rest", "acq": "n/a", "run": "01"},
+    "rest_run-02": {"task": "rest", "acq": "n/a", "run": "02"},
+    "rest_run-03": {"task": "rest", "acq": "n/a", "run": "03"},
+    "nback_acq-VARIANT_run-01": {
+        "task": "nback", "acq": "VARIANT*", "run": "01"
+    },
+    "nback_acq-VARIANT_run-02": {
+        "task": "nback", "acq": "VARIANT*", "run": "02"
+    },
+    "rest_acq-VARIANT_run-01": {
+        "task": "rest", "acq": "VARIANT*", "run": "01"
+    },
+    "rest_acq-VARIANT_run-02": {
+        "task": "rest", "acq": "VARIANT*", "run": "02"
+    },
+    "rest_acq-VARIANT_run-03": {
+        "task": "rest", "acq": "VARIANT*", "run": "03"
+    },
+}
+
+# Atlases requested from XCP-D in config_xcpd_EF_full.yaml
+ATLASES = [
+    "4S1056Parcels", "4S156Parcels", "4S256Parcels", "4S356Parcels",
+    "4S456Parcels", "4S556Parcels", "4S656Parcels", "4S756Parcels",
+    "4S856Parcels", "4S956Parcels", "Glasser", "Gordon", "HCP", "MIDB", "Tian",
+]
+
+
+def plot_group(mean_arr_z, sd_arr_z, layout, exclude_indices_reordered, name):
+    community_order, unique_labels, break_idx, label_idx = layout
+
+    # --- Compute mean ---
+    mean_arr_z = mean_arr_z[community_order, :][:, community_order]
+    np.fill_diagonal(mean_arr_z, 0)
+    mean_arr_r = np.tanh(mean_arr_z)
+    mean_arr_r[exclude_indices_reordered, :] = np.nan
+    mean_arr_r[:, exclude_indices_reordered] = np.nan
+
+    # --- Plot mean matrix ---
+    fig, ax = plt.subplots(figsize=(10, 10))
+    ax.set_facecolor("white")
+    cmap = mpl.cm.get_cmap("seismic").copy()
+    cmap.set_bad(color="none")  # Transparent for NaN
+    ax.imshow(mean_arr_r, cmap=cmap, vmin=-1, vmax=1)
+    for idx in break_idx[1:-1]:
+        ax.axvline(idx, color="black")
+        ax.axhline(idx, color="black")
+    ax.set_yticks(label_idx)
+    ax.set_xticks(label_idx)
+    ax.set_yticklabels(unique_labels)
+    ax.set_xticklabels(unique_labels, rotation=90)
+    fig.tight_layout()
+    fig.savefig(f"{figures_dir}{name}_Mean.png")
+    plt.close()
+
+    # --- Compute SD ---
+    sd_arr_z = sd_arr_z[community_order, :][:, community_order]
+    np.fill_diagonal(sd_arr_z, 0)
+    sd_arr_r = np.tanh(sd_arr_z)
+    sd_arr_r[exclude_indices_reordered, :] = np.nan
+    sd_arr_r[:, exclude_indices_reordered] = np.nan
+
+    # --- Plot SD matrix ---
+    vmax1 = 0.6
+    fig, ax = plt.subplots(figsize=(10, 10))
+    ax.set_facecolor("white")
+    cmap_sd = mpl.cm.get_cmap("Reds").copy()
+    cmap_sd.set_bad(color="none")  # Transparent for NaN
+    ax.imshow(sd_arr_r, cmap=cmap_sd, vmin=0, vmax=vmax1)
+    for idx in break_idx[1:-1]:
+        ax.axvline(idx, color="black")
+        ax.axhline(idx, color="black")
+    ax.set_yticks(label_idx)
+    ax.set_xticks(label_idx)
+    ax.set_yticklabels(unique_labels)
+    ax.set_xticklabels(unique_labels, rotation=90)
+    fig.tight_layout()
+    fig.savefig(f"{figures_dir}{name}_StandardDeviation.png")
+    plt.close()
+
+    # --- Plot colorbars ---
+    fig, axs = plt.subplots(2, 1, figsize=(10, 1.5))
+    norm = mpl.colors.Normalize(vmin=-1, vmax=1)
+    fig.colorbar(mpl.cm.ScalarMappable(norm=norm, cmap="seismic"),
+                 cax=axs[0], orientation="horizontal").set_ticks([-1, 0, 1])
+    norm = mpl.colors.Normalize(vmin=0, vmax=vmax1)
+    fig.colorbar(mpl.cm.ScalarMappable(norm=norm, cmap="Reds"),
+                 cax=axs[1], orientation="horizontal").set_ticks(
+        [0, np.mean([0, vmax1]), vmax1])
+    fig.tight_layout()
+    fig.savefig(f"{figures_dir}{name}_colorbar.png", bbox_inches="tight")
+    plt.close()
+
+
+def select_groups(corrmats, groups, excluded_scans, atlas):
+    """Relmats of each group, after dropping excluded scans."""
+    entities = {cm: scan_entities(cm) for cm in corrmats}
+    selected = {}
+    for task, wanted in groups.items():
+        found = [
+            cm for cm in corrmats
+            if all(
+                fnmatchcase(entities[cm][key], value)
+                for key, value in wanted.items()
+            )
+        ]
+        selected[task] = [cm for cm in found
+                          if not is_excluded(cm, excluded_scans)]
+        print(f"{atlas} {task}: {len(found)} scans found, "
+              f"{len(selected[task])} included after exclusion")
+    return selected
+
+
+def plot_atlas(atlas, groups, excluded_scans, excluded_regions, n_workers=1,
+               rebuild=False, pconn=False, xcpd_dir=xcpd_dir, label=None):
+    # Load parcel dseg info
+    dseg_file = f"{xcpd_dir}atlases/atlas-{atlas}/atlas-{atlas}_dseg.tsv"
+    dseg_df = pd.read_table(dseg_file)
+    layout = community_layout(network_labels(dseg_df))
+    community_order = layout[0]
+
+    # --- Exclude regions based on CSV ---
+    exclude_indices = [i for i, name in enumerate(dseg_df["label"])
+                       if name in excluded_regions]
+    # Remap excluded region indices through community_order
+    exclude_indices_reordered = np.flatnonzero(
+        np.isin(community_order, exclude_indices))
+
+    # Find correlation matrices
+    if pconn:
+        corrmats = sorted(
+            glob(f"{xcpd_dir}sub-*/ses-*/func/{pconn_glob(atlas)}"))
+    else:
+        corrmats = sorted(glob(
+            f"{xcpd_dir}sub-*/ses-*/func/"
+            f"*seg-{atlas}_stat-pearsoncorrelation_relmat.tsv"
+        ))
+    selected = select_groups(corrmats, groups, excluded_scans, atlas)
+
+    # --- Load matrices ---
+    # Group statistics (count, sum of z, sum of z^2) are saved per group, so
+    # only relmats added, changed or excluded since the last run are read,
+    # each once (through the .npy cache) for every group it belongs to
+    os.makedirs(group_stats_dir, exist_ok=True)
+    kind = "pconn" if pconn else "relmat"
+    if label:
+        kind = f"{kind}_{label}"
+    stats_files = {
+        task: f"{group_stats_dir}atlas-{atlas}_{task}_{kind}_stats.npz"
+        for task in selected
+    }
+    accumulators = {
+        task: FisherZAccumulator.load(stats_file)
+        for task, stats_file in stats_files.items()
+        if os.path.exists(stats_file) and not rebuild
+    }
+    if pconn:
+        # Binary already, memory-mapped rather than cached
+        loader = PconnReader(dseg_df["label"])
+    else:
+        # With several workers, each parses its own files on a single thread
+        n_threads = 4 if n_workers <= 1 else 1
+        reader = RelmatReader(dseg_df["label"], n_threads=n_threads)
+        loader = RelmatCache(loader=reader).load
+    changes = update_groups(accumulators, selected, loader, n_workers)
+    for task, (n_added, n_removed) in changes.items():
+        print(f"{atlas} {task}: {n_added} scans added, {n_removed} removed "
+              f"since the last run")
+        # A group that never had a scan has no statistics to keep
+        if accumulators[task].shape is not None:
+            accumulators[task].save(stats_files[task])
+
+    # Figures of the main atlas keep their original names
+    prefix = "XCPD" if atlas == "4S1056Parcels" else f"XCPD_seg-{atlas}"
+    suffix = f"_{label}" if label else ""
+    for task in selected:
+        accumulator = accumulators[task]
+        if accumulator.n == 0:
+            print(f"No {atlas} scans left for {task}, skipping")
+            continue
+        print(f"{atlas} {task} correlation array shape: "
+              f"{accumulator.shape + (accumulator.n,)}")
+        plot_group(accumulator.mean(), accumulator.std(), layout,
+                   exclude_indices_reordered,
+                   f"{prefix}_task-{task}{suffix}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Plot group XCP-D correlation matrices.")
+    parser.add_argument("--groups", nargs="+", choices=list(GROUPS),
+                        default=list(GROUPS))
+    parser.add_argument("--atlas", nargs="+", choices=ATLASES + ["all"],
+                        default=["4S1056Parcels"])
+    parser.add_argument("--n-workers", type=int, default=1)
+    parser.add_argument("--rebuild", action="store_true",
+                        help="ignore the saved group statistics")
+    parser.add_argument("--pconn", action="store_true",
+                        help="read the pconn.nii files instead of the relmat "
+                             "TSVs")
+    parser.add_argument("--xcpd-dir", default=xcpd_dir,
+                        help="XCP-D output directory (with a trailing /)")
+    parser.add_argument("--label",
+                        help="added to the figure and group statistics names")
+    args = parser.parse_args()
+    atlases = ATLASES if "all" in args.atlas else args.atlas
+    args.xcpd_dir = os.path.join(args.xcpd_dir, "")
+    groups = {task: GROUPS[task] for task in args.groups}
+
+    # --- Exclude scans based on CSV ---
+    excluded_scans = read_excluded(
+        f"{processing_dir}excluded_scans_corrmat.csv", "excluded_scans")
+    print("First 5 excluded scan IDs:", list(excluded_scans)[:5])
+    excluded_regions = read_excluded(
+        f"{processing_dir}excluded_regions_corrmat.csv", "excluded_regions")
+
+    if len(atlases) == 1:
+        plot_atlas(atlases[0], groups, excluded_scans, excluded_regions,
+                   args.n_workers, args.rebuild, args.pconn, args.xcpd_dir,
+                   args.label)
+    else:
+        # One atlas per worker, each streaming its files through its own
+        # accumulators, so memory stays at a few matrices per worker
+        with ProcessPoolExecutor(args.n_workers) as pool:
+            futures = {
+                pool.submit(
+                    plot_atlas, atlas, groups, excluded_scans,
+                    excluded_regions, 1, args.rebuild, args.pconn,
+                    args.xcpd_dir, args.label,
+                ): atlas
+                for atlas in atlases
+            }
+            failed = []
+            for future in as_completed(futures):
+                atlas = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"Failed {atlas}: {e!r}")
+                    failed.append(atlas)
+                else:
+                    print(f"Finished {atlas}")
+        if failed:
+            raise SystemExit(f"Failed atlases: {', '.join(failed)}")
@@ -0,0 +1,43 @@
+import numpy as np
+
+from censor_relmats import censored_correlations
+
+# Run with: python -m pytest analysis/02_plot
+
+
+def test_censored_correlations_match_corrcoef():
+    rng = np.random.default_rng(0)
+    n_frames, n_nodes = 120, 6
+    timeseries = rng.standard_normal((n_frames, n_nodes))
+    timeseries[:, 1] += timeseries[:, 0]
+    fd = rng.gamma(2, 0.1, n_frames)
+    fd[0] = np.nan
+    # a NaN in a high-motion frame only matters if that frame is kept
+    timeseries[np.nanargmax(fd), 4] = np.nan
+    thresholds = [0.1, 0.2, 0.5, 10]
+    corrs, n_kept = censored_correlations(timeseries, fd, thresholds)
+
+    for threshold, corr, n in zip(thresholds, corrs, n_kept):
+        keep = np.nan_to_num(fd) <= threshold
+        assert n == keep.sum()
+        expected = np.corrcoef(timeseries[keep], rowvar=False)
+        np.testing.assert_allclose(corr, expected, rtol=1e-10, atol=1e-12)
+    assert np.isnan(corrs[-1][4]).all()
+    assert not np.isnan(corrs[0]).any()
+
+
+def test_too_few_frames_give_nan():
+    rng = np.random.default_rng(1)
+    timeseries = rng.standard_normal((20, 3))
+    timeseries[:, 2] = 1
+    fd = np.full(20, 0.5)
+    fd[3] = 0.05
+    corrs, n_kept = censored_correlations(timeseries, fd, [0.1, 1])
+
+    np.testing.assert_array_equal(n_kept, [1, 20])
+    assert np.isnan(corrs[0]).all()
+    # a node without variance has no correlations
+    assert np.isnan(corrs[1][2]).all() and np.isnan(corrs[1][:, 2]).all()
+    np.testing.assert_allclose(corrs[1][:2, :2],
+                               np.corrcoef(timeseries[:, :2], rowvar=False),
+                               rtol=1e-10)
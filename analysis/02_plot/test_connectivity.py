@@ -0,0 +1,76 @@
+import numpy as np
+
+from connectivity import FisherZAccumulator, NetworkBlocks, fisher_z
+
+# Run with: python -m pytest analysis/02_plot
+
+
+def random_relmats(n_scans, n_nodes, seed=0):
+    """Correlation matrices of random time series, with some NaN entries."""
+    rng = np.random.default_rng(seed)
+    ts = rng.standard_normal((n_scans, n_nodes, 2 * n_nodes))
+    r = np.einsum("sit,sjt->sij", ts, ts)
+    sd = np.sqrt(np.einsum("sii->si", r))
+    r /= sd[:, :, None] * sd[:, None, :]
+    r[::7, 1, 2] = r[::7, 2, 1] = np.nan
+    return r
+
+
+def test_network_blocks_match_a_loop_over_the_matrix():
+    r = random_relmats(3, 12, seed=2)
+    # network "E" has a single node, so its own block has no edges
+    labels = ["A", "A", "B", "B", "B", "C", "A", "C", "D", "D", "E", "B"]
+    blocks = NetworkBlocks(labels)
+    mean, sd = blocks.summarize_matrix(r)
+
+    assert blocks.networks == ["A", "B", "C", "D", "E"]
+    for s in range(len(r)):
+        for a, net_a in enumerate(blocks.networks):
+            for b, net_b in enumerate(blocks.networks):
+                values = [r[s, i, j]
+                          for i in range(12) for j in range(i + 1, 12)
+                          if {labels[i], labels[j]} == {net_a, net_b}
+                          and not np.isnan(r[s, i, j])]
+                if not values:
+                    assert np.isnan(mean[s, a, b])
+                    assert np.isnan(sd[s, a, b])
+                    continue
+                np.testing.assert_allclose(mean[s, a, b], np.mean(values),
+                                           rtol=1e-12)
+                np.testing.assert_allclose(sd[s, a, b], np.std(values),
+                                           rtol=1e-9, atol=1e-12)
+
+
+def test_accumulator_matches_nanmean_and_nanstd():
+    r = random_relmats(500, 40)
+    accumulator = FisherZAccumulator()
+    for relmat in r:
+        accumulator.add(relmat)
+    z = fisher_z(r.copy())
+    diagonal = np.eye(40, dtype=bool)
+
+    np.testing.assert_allclose(accumulator.mean(), np.nanmean(z, axis=0),
+                               rtol=1e-12, atol=1e-12)
+    # std() takes sum(z^2) / n - mean^2, which loses digits to cancellation
+    # where z is large and nearly constant: on the diagonal (clipped to
+    # arctanh(R_CLIP) ~ 7.25) it is off by a few 1e-7 instead of 0.
+    std, expected = accumulator.std(), np.nanstd(z, axis=0)
+    np.testing.assert_allclose(std[diagonal], expected[diagonal], atol=1e-6)
+    np.testing.assert_allclose(std[~diagonal], expected[~diagonal],
+                               rtol=1e-9, atol=1e-12)
+
+
+def test_removed_scans_leave_the_rest():
+    r = random_relmats(60, 10, seed=1)
+    accumulator = FisherZAccumulator()
+    for relmat in r:
+        accumulator.add(relmat)
+    for relmat in r[40:]:
+        accumulator.remove(relmat)
+    z = fisher_z(r[:40].copy())
+
+    assert accumulator.n == 40
+    np.testing.assert_allclose(accumulator.mean(), np.nanmean(z, axis=0),
+                               rtol=1e-9, atol=1e-12)
+    np.testing.assert_allclose(accumulator.std(), np.nanstd(z, axis=0),
+                               rtol=1e-6, atol=1e-6)
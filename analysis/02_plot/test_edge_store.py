@@ -0,0 +1,33 @@
+import numpy as np
+
+from edge_store import n_edges, to_square, upper_triangle
+
+# Run with: python -m pytest analysis/02_plot
+
+
+def test_upper_triangle_round_trip():
+    rng = np.random.default_rng(0)
+    matrix = rng.standard_normal((6, 6)).astype(np.float32)
+    matrix += matrix.T
+    edges = upper_triangle(matrix)
+    assert edges.shape == (n_edges(6),)
+
+    square = to_square(edges, 6)
+    assert square.dtype == np.float32
+    assert np.isnan(np.diag(square)).all()
+    off_diagonal = ~np.eye(6, dtype=bool)
+    np.testing.assert_array_equal(square[off_diagonal],
+                                  matrix[off_diagonal])
+    np.testing.assert_array_equal(upper_triangle(square), edges)
+
+
+def test_to_square_of_a_stack():
+    rng = np.random.default_rng(1)
+    edges = rng.standard_normal((3, 2, n_edges(5)))
+    square = to_square(edges, 5, diagonal=0)
+    assert square.shape == (3, 2, 5, 5)
+    for i in range(3):
+        for j in range(2):
+            expected = to_square(edges[i, j], 5, diagonal=0)
+            np.testing.assert_array_equal(square[i, j], expected)
+            np.testing.assert_array_equal(square[i, j], square[i, j].T)
@@ -0,0 +1,63 @@
+import numpy as np
+
+from connectivity import fisher_z
+from edge_store import n_edges, to_square
+from graph_metrics import GraphMetrics
+
+# Run with: python -m pytest analysis/02_plot
+
+LABELS = ["A", "B", "A", "C", "B", "A", "C", "C", "B", "A"]
+
+
+def random_weights(n_scans, seed=0):
+    """Positive Fisher z weights with a zero diagonal, as in _scan_metrics."""
+    rng = np.random.default_rng(seed)
+    r = np.tanh(rng.normal(0.1, 0.3, (n_scans, n_edges(len(LABELS)))))
+    return to_square(np.maximum(fisher_z(r), 0), len(LABELS), diagonal=0)
+
+
+def test_node_metrics_match_loops():
+    weights = random_weights(3)
+    strength, participation, within_z = GraphMetrics(LABELS).node_metrics(
+        weights)
+
+    n = len(LABELS)
+    networks = sorted(set(LABELS))
+    for s, w in enumerate(weights):
+        for i in range(n):
+            k = sum(w[i, j] for j in range(n))
+            to_module = {m: sum(w[i, j] for j in range(n) if LABELS[j] == m)
+                         for m in networks}
+            np.testing.assert_allclose(strength[s, i], k, rtol=1e-12)
+            np.testing.assert_allclose(
+                participation[s, i],
+                1 - sum((to_module[m] / k) ** 2 for m in networks),
+                rtol=1e-12)
+
+            own = [sum(w[u, j] for j in range(n) if LABELS[j] == LABELS[i])
+                   for u in range(n) if LABELS[u] == LABELS[i]]
+            within = to_module[LABELS[i]]
+            np.testing.assert_allclose(
+                within_z[s, i], (within - np.mean(own)) / np.std(own),
+                rtol=1e-9)
+
+
+def test_system_segregation_matches_loops():
+    weights = random_weights(3, seed=1)
+    segregation, mean_within, mean_between = GraphMetrics(
+        LABELS).system_segregation(weights)
+
+    n = len(LABELS)
+    for s, w in enumerate(weights):
+        within = [w[i, j] for i in range(n) for j in range(n)
+                  if i != j and LABELS[i] == LABELS[j]]
+        between = [w[i, j] for i in range(n) for j in range(n)
+                   if LABELS[i] != LABELS[j]]
+        np.testing.assert_allclose(mean_within[s], np.mean(within),
+                                   rtol=1e-12)
+        np.testing.assert_allclose(mean_between[s], np.mean(between),
+                                   rtol=1e-12)
+        np.testing.assert_allclose(
+            segregation[s],
+            (np.mean(within) - np.mean(between)) / np.mean(within),
+            rtol=1e-12)
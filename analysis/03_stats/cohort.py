@@ -0,0 +1,154 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             "..", "02_plot"))
+from connectivity import (  # noqa: E402
+    community_layout,
+    fisher_z,
+    network_labels,
+    read_excluded,
+)
+from edge_store import EdgeStore, store_dir, xcpd_dir  # noqa: E402
+
+# Shared helpers for the edge-wise connectivity statistics: pick scans from
+# an edge store (see /analysis/02_plot/edge_store.py), join them with
+# subject covariates, build design matrices and put results in network order.
+
+participants_file = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                 "..", "..", "data", "participants.csv")
+# CUBIC project paths
+excluded_scans_file = ("/cbica/projects/executive_function/EF_dataset_figures/"
+                       "processing_scripts/excluded_scans_corrmat.csv")
+results_dir = ("/cbica/projects/executive_function/EF_dataset_figures/"
+               "connectivity_stats/")
+
+
+def _strip(values, prefix):
+    values = values.astype(str).str.strip()
+    return values.str.replace("^" + prefix, "", regex=True)
+
+
+def read_covariates(path, participants=participants_file):
+    """Covariates keyed by sub (and ses, if the table has a session column).
+
+    participant_id (and session_id/session) may carry the "sub-"/"ses-"
+    prefixes. Only subjects in participants.csv are kept.
+    """
+    df = pd.read_csv(path)
+    df["sub"] = _strip(df.pop("participant_id"), "sub-")
+    for column in ("session_id", "session"):
+        if column in df:
+            df["ses"] = _strip(df.pop(column), "ses-")
+    if participants is not None:
+        included = _strip(pd.read_csv(participants)["participant_id"], "sub-")
+        df = df[df["sub"].isin(included)]
+    return df
+
+
+def scan_table(store, covariates=None, exclude=(), **entities):
+    """Scans of the store matching entities, with their covariates.
+
+    The row column holds the scan's row in store.edges.
+    """
+    rows = store.select(exclude=exclude, **entities)
+    table = store.scans.iloc[rows].copy()
+    table["row"] = rows
+    if covariates is not None:
+        keys = ["sub", "ses"] if "ses" in covariates else ["sub"]
+        table = table.merge(covariates, on=keys, how="inner")
+    return table.reset_index(drop=True)
+
+
+def design_matrix(table, terms):
+    """Intercept plus one column per numeric term and dummy columns
+    (first level dropped) per categorical term.
+
+    Returns the design, its column names and the table rows it covers
+    (those with no missing term).
+    """
+    table = table.dropna(subset=list(terms))
+    design = pd.DataFrame({"intercept": 1.0}, index=table.index)
+    for term in terms:
+        values = table[term]
+        if (pd.api.types.is_numeric_dtype(values)
+                and not pd.api.types.is_bool_dtype(values)):
+            design[term] = values.astype(float)
+        else:
+            levels = sorted(values.astype(str).unique())
+            for level in levels[1:]:
+                dummy = values.astype(str) == level
+                design[f"{term}[{level}]"] = dummy.astype(float)
+    return design.to_numpy(), list(design.columns), table
+
+
+def edge_blocks(store, rows, block_size=64):
+    """Fisher z edges of the given store rows, block_size scans at a time."""
+    for start in range(0, len(rows), block_size):
+        block = np.asarray(store.edges[rows[start:start + block_size]],
+                           dtype=np.float64)
+        yield start, fisher_z(block, out=block)
+
+
+def network_order(store, atlas, xcpd_dir=xcpd_dir):
+    """Node order grouping networks (see community_layout), with the
+    ordered node and network labels."""
+    dseg_df = pd.read_table(os.path.join(
+        xcpd_dir, "atlases", f"atlas-{atlas}", f"atlas-{atlas}_dseg.tsv"))
+    networks = dict(zip(dseg_df["label"], network_labels(dseg_df)))
+    labels = [networks[node] for node in store.nodes]
+    order = community_layout(labels)[0]
+    return order, [store.nodes[i] for i in order], [labels[i] for i in order]
+
+
+def add_cohort_arguments(parser, several_atlases=False):
+    """Options picking the atlas, scans and subjects, read by load_cohort()."""
+    if several_atlases:
+        parser.add_argument("--atlas", nargs="+", default=["4S1056Parcels"],
+                            help='atlases, or "all" in the store dir')
+    else:
+        parser.add_argument("--atlas", default="4S1056Parcels")
+    parser.add_argument("--task", default="rest")
+    parser.add_argument("--run")
+    parser.add_argument("--ses")
+    parser.add_argument("--participants", default=participants_file)
+    parser.add_argument("--store-dir", default=store_dir)
+    parser.add_argument("--xcpd-dir", default=xcpd_dir)
+    parser.add_argument("--exclude-scans", default=excluded_scans_file)
+    parser.add_argument("--out-dir", default=results_dir)
+
+
+def store_atlases(args):
+    """Atlases given with --atlas, "all" meaning every store in --store-dir."""
+    if "all" not in args.atlas:
+        return args.atlas
+    return sorted(name[len("atlas-"):] for name in os.listdir(args.store_dir)
+                  if name.startswith("atlas-"))
+
+
+def load_cohort(args, covariates=None, atlas=None):
+    """The edge store, the selected scans (joined with covariates, if a
+    covariates CSV is given) and the entities they were selected on."""
+    store = EdgeStore(os.path.join(args.store_dir,
+                                   f"atlas-{atlas or args.atlas}"))
+    entities = {key: value for key, value in [
+        ("task", args.task), ("run", args.run), ("ses", args.ses)] if value}
+    excluded_scans = ()
+    if args.exclude_scans:
+        excluded_scans = read_excluded(args.exclude_scans, "excluded_scans")
+    if covariates is not None:
+        covariates = read_covariates(covariates, args.participants)
+    table = scan_table(store, covariates, excluded_scans, **entities)
+    return store, table, entities
+
+
+def out_file(args, entities, suffix, atlas=None):
+    os.makedirs(args.out_dir, exist_ok=True)
+    parts = []
+    if atlas or isinstance(args.atlas, str):
+        parts.append(f"atlas-{atlas or args.atlas}")
+    parts += [f"{key}-{value}" for key, value in entities.items()] + [suffix]
+    return os.path.join(args.out_dir, "_".join(parts))
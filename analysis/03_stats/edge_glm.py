@@ -0,0 +1,114 @@
+import argparse
+
+import numpy as np
+from scipy import stats
+
+from cohort import (
+    add_cohort_arguments,
+    design_matrix,
+    edge_blocks,
+    load_cohort,
+    network_order,
+    out_file,
+)
+from edge_store import to_square
+
+# Edge-wise GLM: one OLS fit of Fisher z connectivity on the same design
+# (e.g. diagnosis + age + sex) for every edge of an edge store at once.
+# Covariates come from a CSV with a participant_id column (and optionally
+# session_id), limited to the subjects in /data/participants.csv, e.g.
+#
+#   python edge_glm.py --covariates phenotypes.csv \
+#       --terms diagnosis age sex --task rest --run 01
+#
+# writes beta, t and p for every design column as network-ordered matrices.
+
+
+class EdgeGLM:
+    """Ordinary least squares of one design matrix on every edge.
+
+    The design is decomposed once (QR); blocks of scans then only add
+    X[block].T @ Y[block] and the sum of squares of Y to running totals, so
+    edges are never looped over and Y never has to be held in memory.
+    Edges with a NaN for any scan get NaN statistics.
+    """
+
+    def __init__(self, design, names):
+        self.design = np.asarray(design, dtype=np.float64)
+        self.names = list(names)
+        n_scans, n_columns = self.design.shape
+        _, r = np.linalg.qr(self.design)
+        if np.abs(np.diag(r)).min() < 1e-10 * np.abs(np.diag(r)).max():
+            raise ValueError(f"Design matrix ({', '.join(self.names)}) "
+                             f"is rank deficient")
+        r_inv = np.linalg.inv(r)
+        self.xtx_inv = r_inv @ r_inv.T
+        self.dof = n_scans - n_columns
+        self.xty = None
+
+    def add_block(self, start, y):
+        """Add the edges y (scans x edges) of design rows start onwards."""
+        if self.xty is None:
+            self.xty = np.zeros((len(self.names), y.shape[1]))
+            self.yy = np.zeros(y.shape[1])
+            self.missing = np.zeros(y.shape[1], dtype=bool)
+        nan = np.isnan(y)
+        self.missing |= nan.any(axis=0)
+        y = np.where(nan, 0, y)
+        self.xty += self.design[start:start + len(y)].T @ y
+        self.yy += np.einsum("ij,ij->j", y, y)
+
+    def results(self):
+        """beta, t and p (design columns x edges)."""
+        beta = self.xtx_inv @ self.xty
+        rss = np.maximum(self.yy - np.einsum("ij,ij->j", self.xty, beta), 0)
+        se = np.sqrt(np.outer(np.diag(self.xtx_inv), rss / self.dof))
+        with np.errstate(invalid="ignore", divide="ignore"):
+            t = beta / se
+        p = 2 * stats.t.sf(np.abs(t), self.dof)
+        for arr in (beta, t, p):
+            arr[:, self.missing] = np.nan
+        return beta, t, p
+
+
+def fit_edges(store, table, design, names, block_size=64):
+    glm = EdgeGLM(design, names)
+    for start, z in edge_blocks(store, table["row"].to_numpy(), block_size):
+        glm.add_block(start, z)
+    return glm.results()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Edge-wise GLM of connectivity on subject covariates.")
+    parser.add_argument("--covariates", required=True,
+                        help="CSV with participant_id and the covariate "
+                             "columns")
+    parser.add_argument("--terms", nargs="+", required=True)
+    parser.add_argument("--block-size", type=int, default=64)
+    add_cohort_arguments(parser)
+    args = parser.parse_args()
+
+    store, table, entities = load_cohort(args, args.covariates)
+    design, names, table = design_matrix(table, args.terms)
+    if len(table) <= len(names):
+        raise SystemExit(f"Only {len(table)} scans with covariates for "
+                         f"{len(names)} design columns")
+    if table.duplicated("sub").any():
+        print("Warning: some subjects have several scans; they are treated "
+              "as independent")
+    print(f"Fitting {', '.join(names)} on {len(table)} scans x "
+          f"{store.edges.shape[1]} edges")
+
+    beta, t, p = fit_edges(store, table, design, names, args.block_size)
+    order, nodes, networks = network_order(store, args.atlas, args.xcpd_dir)
+
+    def ordered(values):
+        return to_square(values, store.n_nodes)[:, order][:, :, order]
+
+    glm_file = out_file(args, entities, "glm.npz")
+    np.savez(
+        glm_file, beta=ordered(beta), t=ordered(t), p=ordered(p), terms=names,
+        nodes=nodes, networks=networks, n_scans=len(table),
+    )
+    print(f"Wrote {glm_file}")
@@ -0,0 +1,128 @@
+import argparse
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from cohort import (
+    add_cohort_arguments,
+    load_cohort,
+    out_file,
+    store_atlases,
+)
+from connectivity import fisher_z
+
+# Connectome fingerprinting (Finn et al., 2015): how well a scan's FC profile
+# identifies its subject among the scans of another task or run. Scans are
+# compared by the Pearson correlation of their Fisher z edge vectors, and a
+# target scan is identified if its most similar database scan (other than
+# itself) is from the same subject, e.g.
+#
+#   python fingerprint.py --atlas all --by task
+#   python fingerprint.py --task rest --by run
+#
+# writes identification accuracy and differential identifiability (Amico &
+# Goni, 2018) for every ordered pair of scan groups, and the scans x scans
+# similarity matrix of each atlas.
+
+
+def similarity(store, rows, chunk_size=16384):
+    """Pearson correlation between the Fisher z edge vectors of the given
+    store rows (scans x scans), over the edges present in all of them.
+
+    The edge vectors are z-scored and the correlations are accumulated as
+    one matrix product per chunk of edges, so only scans x chunk_size
+    values are held in memory.
+    """
+    n_edges = store.edges.shape[1]
+    chunks = [slice(start, start + chunk_size)
+              for start in range(0, n_edges, chunk_size)]
+
+    def read(chunk):
+        z = np.asarray(store.edges[rows, chunk], dtype=np.float64)
+        return fisher_z(z, out=z)
+
+    # First pass: valid edges and each scan's mean and SD over them
+    valid, total, total_sq = [], np.zeros(len(rows)), np.zeros(len(rows))
+    for chunk in chunks:
+        z = read(chunk)
+        valid.append(~np.isnan(z).any(axis=0))
+        total += z[:, valid[-1]].sum(axis=1)
+        total_sq += np.einsum("ij,ij->i", z[:, valid[-1]], z[:, valid[-1]])
+    n_valid = sum(mask.sum() for mask in valid)
+    mean = total / n_valid
+    sd = np.sqrt(np.maximum(total_sq / n_valid - mean ** 2, 0))
+
+    # Second pass: correlations of the z-scored edge vectors
+    out = np.zeros((len(rows), len(rows)))
+    for chunk, mask in zip(chunks, valid):
+        z = (read(chunk)[:, mask] - mean[:, None]) / sd[:, None]
+        out += z @ z.T
+    return out / n_valid
+
+
+def identification(sim, subjects, database, target):
+    """Identification accuracy of the target scans against the database
+    scans (boolean masks), the number of target scans with another scan of
+    their subject in the database, and differential identifiability (mean
+    same-subject minus mean other-subject similarity)."""
+    db, tg = np.flatnonzero(database), np.flatnonzero(target)
+    same = subjects[tg][:, None] == subjects[db][None, :]
+    other_scan = tg[:, None] != db[None, :]
+    sim = sim[np.ix_(tg, db)]
+    has_match = (same & other_scan).any(axis=1)
+    if not has_match.any():
+        return np.nan, 0, np.nan
+    sim, same = sim[has_match], same[has_match]
+    other_scan = other_scan[has_match]
+    best = np.argmax(np.where(other_scan, sim, -np.inf), axis=1)
+    accuracy = same[np.arange(len(best)), best].mean()
+    i_diff = sim[same & other_scan].mean() - sim[~same].mean()
+    return accuracy, int(has_match.sum()), i_diff
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Connectome fingerprinting across tasks, runs or "
+                    "sessions.")
+    parser.add_argument("--by", nargs="+", choices=["task", "ses", "run"],
+                        default=["task"],
+                        help="entities defining the scan groups")
+    parser.add_argument("--chunk-size", type=int, default=16384,
+                        help="edges per chunk")
+    add_cohort_arguments(parser, several_atlases=True)
+    parser.set_defaults(task=None)
+    args = parser.parse_args()
+
+    results = []
+    for atlas in store_atlases(args):
+        store, table, entities = load_cohort(args, atlas=atlas)
+        sim = similarity(store, table["row"].to_numpy(), args.chunk_size)
+        groups = table[args.by].astype(str).apply(
+            lambda scan: "_".join(f"{key}-{value}"
+                                  for key, value in scan.items()),
+            axis=1,
+        ).to_numpy()
+        subjects = table["sub"].to_numpy()
+        pairs = itertools.product(sorted(set(groups)), repeat=2)
+        for database, target in pairs:
+            accuracy, n_targets, i_diff = identification(
+                sim, subjects, groups == database, groups == target)
+            results.append({
+                "atlas": atlas, "database": database, "target": target,
+                "n_targets": n_targets, "accuracy": accuracy,
+                "differential_identifiability": i_diff,
+            })
+            print(f"{atlas} {database} -> {target}: {accuracy:.1%} of "
+                  f"{n_targets} scans identified")
+        np.savez(
+            out_file(args, entities, "fingerprint.npz", atlas),
+            similarity=sim,
+            **{key: table[key].to_numpy(dtype=str)
+               for key in ["sub", "ses", "task", "run"]},
+        )
+
+    results_file = out_file(args, entities, "fingerprint.tsv")
+    pd.DataFrame(results).to_csv(results_file, sep="\t", index=False,
+                                 na_rep="n/a")
+    print(f"Wrote {results_file}")
@@ -0,0 +1,110 @@
+import argparse
+
+import numpy as np
+
+from cohort import (
+    add_cohort_arguments,
+    load_cohort,
+    network_order,
+    out_file,
+)
+from connectivity import NetworkBlocks, fisher_z
+from edge_store import to_square
+
+# Test-retest reliability of every edge: ICC(2,1) and ICC(3,1) of Fisher z
+# connectivity across the runs of a session (--over run) or the sessions of a
+# subject (--over ses, for one --run), e.g.
+#
+#   python icc.py --task rest --over run
+#   python icc.py --task rest --run 01 --over ses
+#
+# Only subjects (or subject sessions) with a scan for every repeat are used.
+# Writes network-ordered ICC matrices and their network x network means.
+
+
+def icc(y):
+    """ICC(2,1) and ICC(3,1) (Shrout & Fleiss) of y (subjects x repeats x
+    edges).
+
+    The two-way ANOVA mean squares are computed for all edges at once from
+    the subject, repeat and grand means.
+    """
+    n, k = y.shape[:2]
+    grand = y.mean(axis=(0, 1))
+    ss_subjects = k * ((y.mean(axis=1) - grand) ** 2).sum(axis=0)
+    ss_repeats = n * ((y.mean(axis=0) - grand) ** 2).sum(axis=0)
+    ss_total = ((y - grand) ** 2).sum(axis=(0, 1))
+    ms_subjects = ss_subjects / (n - 1)
+    ms_repeats = ss_repeats / (k - 1)
+    ms_error = (ss_total - ss_subjects - ss_repeats) / ((n - 1) * (k - 1))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        icc3 = (ms_subjects - ms_error) / (ms_subjects + (k - 1) * ms_error)
+        icc2 = (ms_subjects - ms_error) / (
+            ms_subjects + (k - 1) * ms_error
+            + k * (ms_repeats - ms_error) / n)
+    return icc2, icc3
+
+
+def repeat_rows(table, over):
+    """Store rows as a subjects x repeats array, keeping complete subjects.
+
+    Subjects are sub (over ses) or sub and ses (over run); the repeats are
+    the levels of over seen in the table.
+    """
+    units = ["sub"] if over == "ses" else ["sub", "ses"]
+    if table.duplicated(units + [over]).any():
+        raise SystemExit(f"Several scans per {'/'.join(units)} and {over}; "
+                         f"select them with --task/--run/--ses")
+    rows = table.pivot(index=units, columns=over, values="row").dropna()
+    return rows.to_numpy(dtype=np.int64), list(rows.columns)
+
+
+def edge_icc(store, rows, chunk_size=65536):
+    """ICC(2,1) and ICC(3,1) of every edge, chunk_size edges at a time, so
+    only subjects x repeats x chunk_size values are held in memory."""
+    n_edges = store.edges.shape[1]
+    icc2, icc3 = np.empty(n_edges), np.empty(n_edges)
+    for start in range(0, n_edges, chunk_size):
+        chunk = np.asarray(store.edges[rows.ravel(), start:start + chunk_size],
+                           dtype=np.float64)
+        y = fisher_z(chunk, out=chunk).reshape(rows.shape + (-1,))
+        stop = start + y.shape[-1]
+        icc2[start:stop], icc3[start:stop] = icc(y)
+    return icc2, icc3
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Edge-wise test-retest ICC of connectivity.")
+    parser.add_argument("--over", choices=["run", "ses"], default="run",
+                        help="what the repeated measurements are")
+    parser.add_argument("--chunk-size", type=int, default=65536,
+                        help="edges per chunk")
+    add_cohort_arguments(parser)
+    args = parser.parse_args()
+
+    store, table, entities = load_cohort(args)
+    rows, repeats = repeat_rows(table, args.over)
+    if len(rows) < 2 or len(repeats) < 2:
+        raise SystemExit(f"Need at least 2 subjects with at least 2 "
+                         f"{args.over}s, found {len(rows)} with "
+                         f"{len(repeats)}")
+    print(f"ICC over {args.over} {', '.join(repeats)}: {len(rows)} subjects "
+          f"x {store.edges.shape[1]} edges")
+
+    icc2, icc3 = edge_icc(store, rows, args.chunk_size)
+    order, nodes, networks = network_order(store, args.atlas, args.xcpd_dir)
+    blocks = NetworkBlocks(networks)
+    results = {}
+    for name, values in [("icc2", icc2), ("icc3", icc3)]:
+        results[name] = to_square(values, store.n_nodes)[order][:, order]
+        results[f"{name}_networks"] = blocks.summarize_matrix(
+            results[name])[0]
+        print(f"{name.upper()},1: median {np.nanmedian(values):.3f}")
+
+    icc_file = out_file(args, entities, f"icc-{args.over}.npz")
+    np.savez(
+        icc_file, **results, nodes=nodes, networks=networks,
+        network_names=blocks.networks, repeats=repeats, n_subjects=len(rows),
+    )
+    print(f"Wrote {icc_file}")
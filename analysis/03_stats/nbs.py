@@ -0,0 +1,243 @@
+import os
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+from cohort import (
+    add_cohort_arguments,
+    design_matrix,
+    edge_blocks,
+    load_cohort,
+    network_order,
+    out_file,
+)
+from edge_store import to_square
+
+# Network-based statistic (Zalesky et al., 2010) on an edge store: the
+# t-statistic of one design column is thresholded on every edge, and the
+# connected components of the supra-threshold edges are compared to the
+# largest component (in edges) of each of --n-perm permutations, giving
+# FWE-corrected p-values per component. Permutations follow Freedman-Lane:
+# the residuals of the nuisance columns are permuted, so covariates such as
+# age and sex stay in the model, e.g.
+#
+#   python nbs.py --covariates phenotypes.csv \
+#       --terms diagnosis age sex --test "diagnosis[control]" \
+#       --task rest --run 01 --n-perm 5000 --n-workers 16
+#
+# writes the components and the null distribution to a TSV and an .npz of
+# network-ordered t and component matrices.
+
+
+class NBS:
+    """t-statistics of one design column under permutations of the residuals.
+
+    For a permutation P of the nuisance residuals R (scans x edges), the
+    permuted data only enter the fit through Q.T @ P @ R, where Q is the
+    orthonormal basis of the full design. A batch of permutations is stacked
+    into one (batch * columns) x scans matrix, so each batch is a single
+    matrix product with R for all edges. R is read from a memory-mapped .npy
+    file, so worker processes share it through the page cache.
+    """
+
+    def __init__(self, design, column, residuals_file, n_nodes, threshold,
+                 direction=1):
+        self.design = np.asarray(design, dtype=np.float64)
+        self.q, r = np.linalg.qr(self.design)
+        if np.abs(np.diag(r)).min() < 1e-10 * np.abs(np.diag(r)).max():
+            raise ValueError("Design matrix is rank deficient")
+        # beta[column] = w @ Q.T @ y
+        self.w = np.linalg.inv(r)[column]
+        self.dof = self.design.shape[0] - self.design.shape[1]
+        self.residuals_file = residuals_file
+        self.n_nodes = n_nodes
+        self.rows, self.cols = np.triu_indices(n_nodes, k=1)
+        self.threshold = threshold
+        self.direction = direction
+
+    @property
+    def residuals(self):
+        return np.load(self.residuals_file, mmap_mode="r")
+
+    def t_stats(self, perms, chunk_size=65536):
+        """t of the tested column for each permutation (perms x edges)."""
+        residuals = self.residuals
+        n_perms, n_columns = len(perms), self.q.shape[1]
+        # (perms * columns) x scans: P.T @ Q for each permutation
+        stacked = np.concatenate([self.q[perm].T for perm in perms])
+        t = np.empty((n_perms, residuals.shape[1]))
+        for start in range(0, residuals.shape[1], chunk_size):
+            r = np.asarray(residuals[:, start:start + chunk_size],
+                           dtype=np.float64)
+            qr_y = (stacked @ r).reshape(n_perms, n_columns, -1)
+            beta = np.einsum("c,pce->pe", self.w, qr_y)
+            rss = np.maximum(np.einsum("se,se->e", r, r)
+                             - np.einsum("pce,pce->pe", qr_y, qr_y), 0)
+            se = np.sqrt(rss / self.dof * (self.w @ self.w))
+            with np.errstate(invalid="ignore", divide="ignore"):
+                t[:, start:start + r.shape[1]] = beta / se
+        return np.nan_to_num(self.direction * t, nan=0)
+
+    def components(self, t):
+        """Node labels and size (in edges) of each connected component of the
+        edges with t above the threshold; isolated nodes have size 0."""
+        supra = t > self.threshold
+        rows, cols = self.rows[supra], self.cols[supra]
+        graph = sparse.coo_matrix(
+            (np.ones(len(rows), dtype=bool), (rows, cols)),
+            shape=(self.n_nodes, self.n_nodes),
+        )
+        n_components, labels = connected_components(graph, directed=False)
+        sizes = np.bincount(labels[rows], minlength=n_components)
+        return labels, sizes
+
+    def max_sizes(self, perms):
+        return np.array([self.components(t)[1].max()
+                         for t in self.t_stats(perms)])
+
+
+def _null_batch(nbs, seed, n_perms):
+    # Permutations are drawn from the batch's own seed, so the null
+    # distribution does not depend on the number of workers
+    rng = np.random.default_rng(seed)
+    n_scans = nbs.design.shape[0]
+    return nbs.max_sizes([rng.permutation(n_scans) for _ in range(n_perms)])
+
+
+def null_distribution(nbs, n_perm, seed=0, n_workers=1, batch_size=32):
+    """Largest component size of each of n_perm permutations."""
+    counts = [min(batch_size, n_perm - start)
+              for start in range(0, n_perm, batch_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(counts))
+    if n_workers <= 1:
+        return np.concatenate([_null_batch(nbs, s, n)
+                               for s, n in zip(seeds, counts)])
+    with ProcessPoolExecutor(n_workers) as pool:
+        batches = pool.map(_null_batch, [nbs] * len(counts), seeds, counts)
+        return np.concatenate(list(batches))
+
+
+def write_residuals(store, rows, nuisance, residuals_file, block_size=64):
+    """Save the residuals of the Fisher z edges on the nuisance columns
+    (scans x edges, float32) to residuals_file; edges with a NaN for any scan
+    are set to 0 and returned as a mask."""
+    nuisance = np.asarray(nuisance, dtype=np.float64)
+    zty = np.zeros((nuisance.shape[1], store.edges.shape[1]))
+    missing = np.zeros(store.edges.shape[1], dtype=bool)
+    for start, z in edge_blocks(store, rows, block_size):
+        missing |= np.isnan(z).any(axis=0)
+        zty += nuisance[start:start + len(z)].T @ np.nan_to_num(z)
+    gamma = np.linalg.lstsq(nuisance.T @ nuisance, zty, rcond=None)[0]
+    residuals = np.lib.format.open_memmap(
+        residuals_file, mode="w+", dtype=np.float32,
+        shape=(len(rows), store.edges.shape[1]),
+    )
+    for start, z in edge_blocks(store, rows, block_size):
+        fitted = nuisance[start:start + len(z)] @ gamma
+        residuals[start:start + len(z)] = np.nan_to_num(z) - fitted
+    residuals[:, missing] = 0
+    residuals.flush()
+    return missing
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Network-based statistic of one design column.")
+    parser.add_argument("--covariates", required=True,
+                        help="CSV with participant_id and the covariate "
+                             "columns")
+    parser.add_argument("--terms", nargs="+", required=True)
+    parser.add_argument("--test", required=True,
+                        help="design column to test, e.g. age or "
+                             "diagnosis[control]")
+    parser.add_argument("--threshold", type=float, default=3.0,
+                        help="primary t threshold")
+    parser.add_argument("--direction", choices=["positive", "negative"],
+                        default="positive")
+    parser.add_argument("--n-perm", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--n-workers", type=int, default=1)
+    parser.add_argument("--batch-size", type=int, default=32,
+                        help="permutations per matrix product")
+    parser.add_argument("--block-size", type=int, default=64)
+    add_cohort_arguments(parser)
+    args = parser.parse_args()
+
+    store, table, entities = load_cohort(args, args.covariates)
+    design, names, table = design_matrix(table, args.terms)
+    if args.test not in names:
+        raise SystemExit(f"--test must be one of {', '.join(names)}")
+    if len(table) <= len(names):
+        raise SystemExit(f"Only {len(table)} scans with covariates for "
+                         f"{len(names)} design columns")
+    if table.duplicated("sub").any():
+        print("Warning: some subjects have several scans; permutations "
+              "treat them as exchangeable")
+    column = names.index(args.test)
+    nuisance = np.delete(design, column, axis=1)
+    direction = 1 if args.direction == "positive" else -1
+
+    # Residuals are written next to the results, where there is room for them
+    os.makedirs(args.out_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=args.out_dir) as tmp_dir:
+        residuals_file = os.path.join(tmp_dir, "residuals.npy")
+        missing = write_residuals(store, table["row"].to_numpy(), nuisance,
+                                  residuals_file, args.block_size)
+        nbs = NBS(design, column, residuals_file, store.n_nodes,
+                  args.threshold, direction)
+
+        # Observed statistics (the identity permutation gives the plain GLM t)
+        t = nbs.t_stats([np.arange(len(table))])[0]
+        t[missing] = np.nan
+        labels, sizes = nbs.components(np.nan_to_num(t))
+        print(f"{args.test} ({args.direction}, t > {args.threshold}): "
+              f"{len(table)} scans, {sizes.sum()} supra-threshold edges, "
+              f"largest component {sizes.max()} edges")
+
+        print(f"Running {args.n_perm} permutations on {args.n_workers} "
+              f"workers")
+        null = null_distribution(nbs, args.n_perm, args.seed, args.n_workers,
+                                 args.batch_size)
+
+    # Components with at least one edge, largest first
+    found = np.flatnonzero(sizes)
+    found = found[np.argsort(-sizes[found], kind="stable")]
+    order, nodes, networks = network_order(store, args.atlas, args.xcpd_dir)
+    edge_component = np.zeros(len(t), dtype=np.int32)
+    components = []
+    for i, label in enumerate(found, start=1):
+        in_component = labels == label
+        members = in_component[nbs.rows] & (np.nan_to_num(t) > args.threshold)
+        edge_component[members] = i
+        component_networks = np.asarray(networks)[
+            np.isin(order, np.flatnonzero(in_component))]
+        components.append({
+            "component": i,
+            "n_edges": sizes[label],
+            "n_nodes": np.count_nonzero(in_component),
+            "networks": ",".join(sorted(set(component_networks))),
+            "p_fwe": ((1 + np.count_nonzero(null >= sizes[label]))
+                      / (1 + len(null))),
+        })
+    components = pd.DataFrame(components, columns=[
+        "component", "n_edges", "n_nodes", "networks", "p_fwe"])
+
+    suffix = f"nbs-{args.test}_{args.direction}"
+    components_file = out_file(args, entities, f"{suffix}.tsv")
+    components.to_csv(components_file, sep="\t", index=False)
+    nbs_file = out_file(args, entities, f"{suffix}.npz")
+    component = to_square(edge_component, store.n_nodes, diagonal=0)
+    np.savez(
+        nbs_file,
+        t=to_square(t, store.n_nodes)[order][:, order],
+        component=component[order][:, order],
+        null=null, threshold=args.threshold, nodes=nodes, networks=networks,
+        n_scans=len(table),
+    )
+    print(components.to_string(index=False))
+    print(f"Wrote {components_file} and {nbs_file}")
@@ -0,0 +1,114 @@
+import argparse
+import time
+
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from cohort import (
+    add_cohort_arguments,
+    design_matrix,
+    load_cohort,
+    out_file,
+    store_atlases,
+)
+from connectivity import motion_file
+from edge_glm import fit_edges
+
+# QC-FC: the partial correlation, across all scans of a task, between each
+# scan's median framewise displacement (as in
+# QC/qc_scripts/concat_qc_xcpd.py) and every edge's Fisher z, controlling for
+# age and sex. Little QC-FC, and few edges significantly related to motion,
+# means denoising removed most motion artifact. For each atlas, e.g.
+#
+#   python qc_fc.py --covariates phenotypes.csv --task rest --atlas all
+#
+# writes a summary row (QC-FC quantiles and fraction of significant edges)
+# to a TSV, the QC-FC of every edge to an .npz and the distributions to a PNG.
+
+QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+
+
+def median_fd(paths):
+    return np.array([
+        pd.read_table(motion_file(path))["framewise_displacement"].median()
+        for path in paths
+    ])
+
+
+def qc_fc(store, table, covariates, block_size=64):
+    """Partial correlation of median FD with every edge given the covariates,
+    with its p-value and the number of scans used.
+
+    Fits [intercept, covariates, fd] on every edge (see EdgeGLM): the
+    partial correlation follows from the t of fd as t / sqrt(t^2 + dof).
+    """
+    table = table.assign(fd=median_fd(table["path"]))
+    design, names, table = design_matrix(table, list(covariates) + ["fd"])
+    _, t, p = fit_edges(store, table, design, names, block_size)
+    dof = len(table) - len(names)
+    t, p = t[names.index("fd")], p[names.index("fd")]
+    return t / np.sqrt(t ** 2 + dof), p, len(table)
+
+
+def summarize(r, p, alpha=0.05):
+    """QC-FC quantiles and the fraction of edges with motion effects at alpha,
+    uncorrected and FDR-corrected (Benjamini-Hochberg)."""
+    tested = ~np.isnan(r)
+    r, p = r[tested], p[tested]
+    summary = {f"qc_fc_q{int(q * 100):02d}": value
+               for q, value in zip(QUANTILES, np.quantile(r, QUANTILES))}
+    summary["median_abs_qc_fc"] = np.median(np.abs(r))
+    summary["n_edges"] = len(r)
+    summary["frac_p05"] = np.mean(p < alpha)
+    summary["frac_fdr05"] = np.mean(stats.false_discovery_control(p) < alpha)
+    return summary
+
+
+def plot_distributions(qc_fcs, png_file):
+    fig, ax = plt.subplots(figsize=(6, 4))
+    bins = np.linspace(-1, 1, 101)
+    for atlas, r in qc_fcs.items():
+        ax.hist(r[~np.isnan(r)], bins=bins, density=True, histtype="step",
+                label=atlas)
+    ax.axvline(0, color="black", linewidth=0.5)
+    ax.set_xlabel("QC-FC (partial r of median FD)")
+    ax.set_ylabel("Density")
+    ax.legend(fontsize="small")
+    fig.tight_layout()
+    fig.savefig(png_file, dpi=300)
+    plt.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="QC-FC of median framewise displacement on every edge.")
+    parser.add_argument("--covariates", required=True,
+                        help="CSV with participant_id and the covariate "
+                             "columns")
+    parser.add_argument("--terms", nargs="+", default=["age", "sex"],
+                        help="covariates of the partial correlation")
+    parser.add_argument("--block-size", type=int, default=64)
+    add_cohort_arguments(parser, several_atlases=True)
+    args = parser.parse_args()
+
+    summaries, qc_fcs = [], {}
+    for atlas in store_atlases(args):
+        start = time.perf_counter()
+        store, table, entities = load_cohort(args, args.covariates, atlas)
+        r, p, n_scans = qc_fc(store, table, args.terms, args.block_size)
+        qc_fcs[atlas] = r
+        summary = {"atlas": atlas, "n_scans": n_scans, **summarize(r, p)}
+        summaries.append(summary)
+        np.savez(out_file(args, entities, "qc-fc.npz", atlas), qc_fc=r, p=p,
+                 nodes=store.nodes, n_scans=n_scans)
+        print(f"{atlas}: {n_scans} scans, median |QC-FC| "
+              f"{summary['median_abs_qc_fc']:.3f}, "
+              f"{summary['frac_p05']:.1%} of edges p < 0.05 "
+              f"({time.perf_counter() - start:.1f} s)")
+
+    summary_file = out_file(args, entities, "qc-fc.tsv")
+    pd.DataFrame(summaries).to_csv(summary_file, sep="\t", index=False)
+    plot_distributions(qc_fcs, out_file(args, entities, "qc-fc.png"))
+    print(f"Wrote {summary_file}")
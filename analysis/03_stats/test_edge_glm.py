@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+from scipy import stats
+
+from edge_glm import EdgeGLM
+
+# Run with: python -m pytest analysis/03_stats
+
+
+def test_edge_glm_matches_lstsq():
+    rng = np.random.default_rng(0)
+    n_scans, n_edges = 50, 200
+    design = np.column_stack([np.ones(n_scans),
+                              rng.standard_normal((n_scans, 2))])
+    y = (design @ rng.standard_normal((3, n_edges))
+         + rng.standard_normal((n_scans, n_edges)))
+    y[7, 5] = np.nan
+    glm = EdgeGLM(design, ["intercept", "a", "b"])
+    for start in range(0, n_scans, 16):
+        glm.add_block(start, y[start:start + 16])
+    beta, t, p = glm.results()
+
+    tested = np.arange(n_edges) != 5
+    expected, rss = np.linalg.lstsq(design, y[:, tested], rcond=None)[:2]
+    dof = n_scans - 3
+    se = np.sqrt(np.outer(np.diag(np.linalg.inv(design.T @ design)),
+                          rss / dof))
+    np.testing.assert_allclose(beta[:, tested], expected, rtol=1e-9,
+                               atol=1e-12)
+    np.testing.assert_allclose(t[:, tested], expected / se, rtol=1e-9)
+    np.testing.assert_allclose(
+        p[:, tested], 2 * stats.t.sf(np.abs(expected / se), dof), rtol=1e-6)
+    for values in (beta, t, p):
+        assert np.isnan(values[:, 5]).all()
+
+
+def test_rank_deficient_design_is_rejected():
+    x = np.arange(10.0)
+    with pytest.raises(ValueError):
+        EdgeGLM(np.column_stack([np.ones(10), x, 2 * x]),
+                ["intercept", "x", "2x"])
@@ -0,0 +1,41 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from connectivity import fisher_z
+from fingerprint import identification, similarity
+
+# Run with: python -m pytest analysis/03_stats
+
+
+def test_similarity_matches_corrcoef():
+    rng = np.random.default_rng(0)
+    edges = np.tanh(rng.normal(0, 0.4, (9, 100))).astype(np.float32)
+    edges[2, [5, 61]] = np.nan
+    edges[7, 99] = np.nan
+    rows = np.array([8, 0, 2, 5, 3])
+    sim = similarity(SimpleNamespace(edges=edges), rows, chunk_size=16)
+
+    valid = ~np.isnan(edges[rows]).any(axis=0)
+    expected = np.corrcoef(fisher_z(edges[rows][:, valid].astype(float)))
+    np.testing.assert_allclose(sim, expected, rtol=1e-9, atol=1e-12)
+
+
+def test_identification():
+    # scans 0-2 in the database, 3-5 the targets; subject a's target is
+    # closest to subject b's scan
+    subjects = np.array(["a", "b", "c", "a", "b", "c"])
+    sim = np.array([[1.0, 0.2, 0.1, 0.5, 0.2, 0.1],
+                    [0.2, 1.0, 0.3, 0.6, 0.9, 0.3],
+                    [0.1, 0.3, 1.0, 0.1, 0.3, 0.8],
+                    [0.5, 0.6, 0.1, 1.0, 0.2, 0.1],
+                    [0.2, 0.9, 0.3, 0.2, 1.0, 0.3],
+                    [0.1, 0.3, 0.8, 0.1, 0.3, 1.0]])
+    database = np.arange(6) < 3
+    accuracy, n_targets, i_diff = identification(sim, subjects, database,
+                                                 ~database)
+
+    assert n_targets == 3
+    np.testing.assert_allclose(accuracy, 2 / 3)
+    np.testing.assert_allclose(i_diff, (0.5 + 0.9 + 0.8) / 3
+                               - (0.6 + 0.1 + 0.2 + 0.3 + 0.1 + 0.3) / 6)
@@ -0,0 +1,41 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from connectivity import fisher_z
+from icc import edge_icc, icc
+
+# Run with: python -m pytest analysis/03_stats
+
+
+def test_icc_of_shrout_and_fleiss_table():
+    # Shrout & Fleiss (1979), Table 2: 6 targets rated by 4 judges, with
+    # ICC(2,1) = .29 and ICC(3,1) = .71
+    ratings = np.array([[9, 2, 5, 8],
+                        [6, 1, 3, 2],
+                        [8, 4, 6, 8],
+                        [7, 1, 2, 6],
+                        [10, 5, 6, 9],
+                        [6, 2, 4, 7]], dtype=float)
+    icc2, icc3 = icc(ratings[:, :, None])
+    np.testing.assert_allclose(icc2, [0.29], atol=0.005)
+    np.testing.assert_allclose(icc3, [0.71], atol=0.005)
+
+
+def test_edge_icc_in_chunks():
+    rng = np.random.default_rng(0)
+    n_subjects, n_repeats, n_edges = 12, 3, 50
+    subject = rng.normal(0, 0.3, (n_subjects, 1, n_edges))
+    noise = rng.normal(0, 0.2, (n_subjects, n_repeats, n_edges))
+    r = np.tanh(subject + noise)
+    # store rows in a shuffled order
+    order = rng.permutation(n_subjects * n_repeats)
+    edges = np.empty((n_subjects * n_repeats, n_edges), dtype=np.float32)
+    edges[order] = r.reshape(-1, n_edges)
+    rows = order.reshape(n_subjects, n_repeats)
+
+    icc2, icc3 = edge_icc(SimpleNamespace(edges=edges), rows, chunk_size=7)
+    expected = icc(fisher_z(edges[rows].astype(np.float64)))
+    np.testing.assert_allclose(icc2, expected[0], rtol=1e-12)
+    np.testing.assert_allclose(icc3, expected[1], rtol=1e-12)
+    assert (icc3 > 0.5).mean() > 0.5
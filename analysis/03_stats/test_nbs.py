@@ -0,0 +1,57 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+from edge_glm import EdgeGLM, fit_edges
+from edge_store import n_edges
+from nbs import NBS, null_distribution, write_residuals
+
+# Run with: python -m pytest analysis/03_stats
+
+N_SCANS, N_NODES = 40, 8
+
+
+def make_nbs(tmp_path, threshold=2.0):
+    rng = np.random.default_rng(0)
+    design = np.column_stack([np.ones(N_SCANS),
+                              np.repeat([0.0, 1.0], N_SCANS // 2),
+                              rng.uniform(8, 20, N_SCANS)])
+    effect = np.zeros((3, n_edges(N_NODES)))
+    effect[1, :6] = 0.3
+    effect[2] = 0.01
+    r = np.tanh(design @ effect
+                + rng.normal(0, 0.3, (N_SCANS, n_edges(N_NODES))))
+    store = SimpleNamespace(edges=r.astype(np.float32))
+    residuals_file = str(tmp_path / "residuals.npy")
+    write_residuals(store, np.arange(N_SCANS), np.delete(design, 1, axis=1),
+                    residuals_file, block_size=16)
+    nbs = NBS(design, 1, residuals_file, N_NODES, threshold)
+    return nbs, store, design
+
+
+def test_t_matches_the_glm(tmp_path):
+    nbs, store, design = make_nbs(tmp_path)
+    names = ["intercept", "group", "age"]
+    perm = np.random.default_rng(1).permutation(N_SCANS)
+    t = nbs.t_stats([np.arange(N_SCANS), perm], chunk_size=10)
+
+    # identity: the GLM t of the Fisher z edges
+    _, expected, _ = fit_edges(store, pd.DataFrame({"row": range(N_SCANS)}),
+                               design, names, block_size=16)
+    np.testing.assert_allclose(t[0], expected[1], rtol=1e-4, atol=1e-4)
+    # a permutation: the GLM t of the permuted nuisance residuals (permuting
+    # the rows of Q by perm is permuting R by its inverse)
+    glm = EdgeGLM(design, names)
+    residuals = np.asarray(nbs.residuals, dtype=np.float64)
+    glm.add_block(0, residuals[np.argsort(perm)])
+    np.testing.assert_allclose(t[1], glm.results()[1][1], rtol=1e-9,
+                               atol=1e-9)
+
+
+def test_null_does_not_depend_on_workers(tmp_path):
+    nbs = make_nbs(tmp_path, threshold=1.0)[0]
+    serial = null_distribution(nbs, 20, seed=3, n_workers=1, batch_size=6)
+    parallel = null_distribution(nbs, 20, seed=3, n_workers=2, batch_size=6)
+    assert len(serial) == 20
+    np.testing.assert_array_equal(serial, parallel)
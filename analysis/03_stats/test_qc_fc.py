@@ -0,0 +1,49 @@
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+
+from qc_fc import qc_fc
+
+# Run with: python -m pytest analysis/03_stats
+
+
+def test_qc_fc_matches_residualized_correlation(tmp_path):
+    rng = np.random.default_rng(0)
+    n_scans, n_edges = 30, 50
+    table = pd.DataFrame({
+        "row": np.arange(n_scans),
+        "age": rng.uniform(8, 20, n_scans),
+        "sex": rng.choice(["F", "M"], n_scans),
+    })
+    fd = []
+    paths = []
+    for i in range(n_scans):
+        run = os.path.join(tmp_path, f"sub-{i:02d}_ses-1_task-rest_run-01")
+        frames = rng.gamma(2, 0.05 + 0.01 * i, 100)
+        pd.DataFrame({"framewise_displacement": frames}).to_csv(
+            run + "_motion.tsv", sep="\t", index=False)
+        fd.append(np.median(frames))
+        paths.append(run + "_space-fsLR_seg-test_stat-pearsoncorrelation"
+                     "_relmat.tsv")
+    table["path"] = paths
+    fd = np.array(fd)
+    z = (0.5 * fd[:, None] + 0.01 * table[["age"]].to_numpy()
+         + rng.normal(0, 0.1, (n_scans, n_edges)))
+    store = SimpleNamespace(edges=np.tanh(z).astype(np.float32))
+    r, p, n = qc_fc(store, table, ["age", "sex"], block_size=8)
+
+    covariates = np.column_stack([np.ones(n_scans), table["age"],
+                                  table["sex"] == "M"])
+
+    def residuals(y):
+        return y - covariates @ np.linalg.lstsq(covariates, y, rcond=None)[0]
+
+    z = np.arctanh(store.edges.astype(np.float64))
+    fd_res, z_res = residuals(fd), residuals(z)
+    expected = [np.corrcoef(fd_res, z_res[:, edge])[0, 1]
+                for edge in range(n_edges)]
+    assert n == n_scans
+    np.testing.assert_allclose(r, expected, rtol=1e-9)
+    assert (p > 0).all() and (p < 1).all()